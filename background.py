@@ -0,0 +1,82 @@
+import threading
+
+# Futures are concurrent.futures.Future where available (with the futures backport), so
+# that several runs can be waited for together with futures.wait or futures.as_completed
+try:
+    from concurrent.futures import Future
+except ImportError:
+    Future = None
+
+class _Future():
+# {{{
+    ''' Minimal stand-in for concurrent.futures.Future. '''
+
+    def __init__(self):
+        self._done      = threading.Event()
+        self._result    = None
+        self._exception = None
+        self._callbacks = []
+        self._lock      = threading.Lock()
+
+    def done(self):
+        return self._done.is_set()
+
+    def running(self):
+        return not self._done.is_set()
+
+    def cancel(self):
+        # Calculations cannot be interrupted once started
+        return False
+
+    def cancelled(self):
+        return False
+
+    def result(self, timeout=None):
+        if not self._done.wait(timeout): raise RuntimeError('Timed out waiting for result.')
+        if self._exception is not None: raise self._exception
+        return self._result
+
+    def exception(self, timeout=None):
+        if not self._done.wait(timeout): raise RuntimeError('Timed out waiting for result.')
+        return self._exception
+
+    def add_done_callback(self, fn):
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(fn)
+                return
+        fn(self)
+
+    def _finish(self):
+        with self._lock:
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for fn in callbacks: fn(self)
+
+    def set_result(self, result):
+        self._result = result
+        self._finish()
+
+    def set_exception(self, exception):
+        self._exception = exception
+        self._finish()
+# }}}
+
+if Future is None: Future = _Future
+
+def submit(fn, *args, **kwargs):
+# {{{
+    ''' Call fn(*args, **kwargs) in a new thread; returns a Future of its result. '''
+    future = Future()
+    if hasattr(future, 'set_running_or_notify_cancel'): future.set_running_or_notify_cancel()
+
+    def work():
+        try: r = fn(*args, **kwargs)
+        except Exception as e: future.set_exception(e)
+        else: future.set_result(r)
+
+    t = threading.Thread(target=work)
+    t.daemon = True
+    t.start()
+    return future
+# }}}
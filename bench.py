@@ -0,0 +1,217 @@
+import numpy as np
+import glob, timeit, json, time, sys, platform, resource, multiprocessing, subprocess, Queue
+import pyr_ascii, params
+
+# Benchmarks of the PyRaccoons machinery (not of the radiative codes themselves).
+# Run as 'python bench.py' from the top level directory; 'python bench.py suite'
+# runs the throughput suite instead, and 'python bench.py imports' the import times.
+
+def timeper(f, n):
+# {{{
+    ''' Best-of-three time in seconds of a single call to f, averaged over n calls. '''
+    return min(timeit.repeat(f, number=n, repeat=3)) / n
+# }}}
+
+def parse(n=20):
+# {{{
+    ''' Compare pyr_ascii.read_columns against np.genfromtxt on the shipped output files. '''
+    cases = [('RRTM_SW', sorted(glob.glob('rrtm_ascii/RRTM_SW_*_output_*')), 81, 8, 5, 14),
+             ('ZH flux', sorted(glob.glob('zh_ascii/ZH_*_output_fluxes_*')), 101, 4, 0, 0)]
+
+    print '%-10s %6s %14s %14s %8s' % ('files', 'count', 'genfromtxt', 'read_columns', 'speedup')
+    for name, fns, nrows, ncols, nh, nf in cases:
+        tg = timeper(lambda: [np.genfromtxt(fn, skip_header=nh, skip_footer=nf) for fn in fns], n)
+        tr = timeper(lambda: [pyr_ascii.read_columns(fn, nrows, ncols, nh) for fn in fns], n)
+        print '%-10s %6d %11.1f us %11.1f us %7.1fx' % (name, len(fns), 1e6 * tg / len(fns), 1e6 * tr / len(fns), tg / tr)
+# }}}
+
+def zh(Np=20):
+# {{{
+    ''' Per-column latency of ZH through the zh_lw_sw executable and, if available, in-process. '''
+    import pyr_zh
+
+    Nl = 100
+    zh = np.linspace(60, 0, Nl+1)
+    ph = 1000.*np.exp(-zh / 7.)
+    pf = np.sqrt(ph[:-1] * ph[1:])
+
+    prm = pyr_zh.ZH(Nl, Np, pres=pf, phalf=ph)
+
+    print '%-24s %12s' % ('ZH path', 'per column')
+    t = timeper(lambda: prm.run(keep='none', inproc=False), 1)
+    print '%-24s %9.2f ms' % ('subprocess', 1e3 * t / Np)
+    for w in [2, 4]:
+        t = timeper(lambda: prm.run(keep='none', inproc=False, workers=w), 1)
+        print '%-24s %9.2f ms' % ('subprocess, %d workers' % w, 1e3 * t / Np)
+
+    if pyr_zh.morcrette is not None:
+        t = timeper(lambda: prm.run(inproc=True), 1)
+        print '%-24s %9.2f ms' % ('in-process', 1e3 * t / Np)
+    else:
+        print '%-24s %12s' % ('in-process', 'unavailable')
+# }}}
+
+class _Walk(params.SW):
+# {{{
+    ''' Parameter set resolving attributes as ParamSet did before the name index: by
+        walking its namelists on every access. '''
+    def __getattr__(self, name):
+        for l in self._lists:
+            if l.name == name: return l
+            if l.active and l.prm_dict.has_key(name): return l.__getattr__(name)
+        raise AttributeError("'%s' object has no parameter '%s'" % (self.__class__.__name__, name))
+
+    def __setattr__(self, name, value):
+        for l in [l for l in self._lists if l.active]:
+            if l.prm_dict.has_key(name):
+                l.__setattr__(name, value)
+                return
+        if self.__dict__.has_key(name): self.__dict__[name] = value
+        else: raise AttributeError("'%s' object has no parameter '%s'" % (self.__class__.__name__, name))
+# }}}
+
+def attrs(n=200000):
+# {{{
+    ''' Cost of reading and setting a parameter through ParamSet.__getattr__ and
+        __setattr__, which use the name index, against the same through the walk
+        over the namelists they did before the index existed. '''
+    prm  = params.SW('bench', 40, 4)
+    walk = _Walk('bench', 40, 4)
+
+    print '%-10s %12s %12s %12s %12s' % ('parameter', 'get walk', 'get index', 'set walk', 'set index')
+    for name in ['pres', 'O2', 'cosz', 'scon']:
+        v  = getattr(prm, name)
+        tw = timeper(lambda: getattr(walk, name), n)
+        ti = timeper(lambda: getattr(prm, name), n)
+        sw = timeper(lambda: setattr(walk, name, v), n // 10)
+        si = timeper(lambda: setattr(prm, name, v), n // 10)
+        print '%-10s %9.0f ns %9.0f ns %9.0f ns %9.0f ns' % (name, 1e9 * tw, 1e9 * ti, 1e9 * sw, 1e9 * si)
+# }}}
+
+# Backends of the throughput suite: module, class, and the largest number of profiles
+# to run (the ascii backends launch a process per profile). ZH is built for 100 levels.
+backends = [('pyr_rrtmg', 'RRTMG_LW', None),
+            ('pyr_rrtmg', 'RRTMG_SW', None),
+            ('pyr_rrtm',  'RRTM_LW',  1000),
+            ('pyr_rrtm',  'RRTM_SW',  1000),
+            ('pyr_zh',    'ZH',       1000)]
+levels = dict(ZH = [100])
+
+def case(cls, Nl, Np, repeat=3):
+# {{{
+    ''' Construction time, run time and peak memory of cls on Np profiles of Nl levels. '''
+    z  = np.linspace(60, 0, Nl+1)
+    ph = 1000.*np.exp(-z / 7.)
+    pf = np.sqrt(ph[:-1] * ph[1:])
+
+    opts = dict(keep='none') if issubclass(cls, pyr_ascii.AsciiRun) else {}
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    tc  = min(timeit.repeat(lambda: cls(Nl, Np, pres=pf, phalf=ph), number=1, repeat=repeat))
+
+    prm = cls(Nl, Np, pres=pf, phalf=ph)
+    tr  = min(timeit.repeat(lambda: prm.run(**opts), number=1, repeat=repeat))
+
+    return dict(construct_s = tc, run_s = tr, columns_per_s = Np / tr, \
+                peak_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss)
+# }}}
+
+def suite(Nls=[40, 100, 200], Nps=[1, 100, 10000, 100000], fn='bench.json', timeout=3600):
+# {{{
+    ''' Throughput, memory use and construction cost of each backend over a grid of
+        numbers of levels and profiles, saved to json file fn. Each case runs in a
+        separate process so that its peak memory is measured on its own (as the
+        increase of the maximum resident set size, in kB). Cases whose process dies,
+        e.g. for lack of memory, or takes longer than timeout seconds are recorded
+        as errors. '''
+    def run(q, cls, Nl, Np):
+        try: q.put(case(cls, Nl, Np))
+        except Exception as e: q.put(dict(error = '%s: %s' % (e.__class__.__name__, e)))
+
+    results = []
+    print '%-10s %5s %7s %14s %12s %12s' % ('backend', 'Nl', 'Np', 'columns/s', 'peak kB', 'construct')
+    for mod, name, maxp in backends:
+        try: cls = getattr(__import__(mod), name)
+        except Exception as e:
+            print '%-10s %s' % (name, 'unavailable (%s)' % e)
+            continue
+
+        for Nl in levels.get(name, Nls):
+            for Np in Nps:
+                if maxp is not None and Np > maxp: continue
+
+                q = multiprocessing.Queue()
+                p = multiprocessing.Process(target=run, args=(q, cls, Nl, Np))
+                p.start()
+                r = result(q, p, timeout)
+
+                r.update(backend = name, Nl = Nl, Np = Np)
+                results.append(r)
+                if r.has_key('error'):
+                    print '%-10s %5d %7d %s' % (name, Nl, Np, r['error'])
+                else:
+                    print '%-10s %5d %7d %14.1f %12d %9.2f ms' % \
+                        (name, Nl, Np, r['columns_per_s'], r['peak_rss_kb'], 1e3 * r['construct_s'])
+
+    info = dict(time = time.strftime('%Y-%m-%dT%H:%M:%S'), python = platform.python_version(), \
+                numpy = np.__version__, machine = platform.machine(), cpus = multiprocessing.cpu_count())
+    with open(fn, 'w') as f:
+        json.dump(dict(info = info, results = results), f, indent=1, sort_keys=True)
+    return results
+# }}}
+
+def result(q, p, timeout):
+# {{{
+    ''' Result put in queue q by process p, or an error if p dies or times out first. '''
+    deadline = time.time() + timeout
+    while True:
+        try:
+            r = q.get(timeout=1.)
+            break
+        except Queue.Empty:
+            if not p.is_alive():
+                # The result may have been put just before the process exited
+                try: r = q.get(timeout=1.)
+                except Queue.Empty: r = dict(error = 'process exited with status %s' % p.exitcode)
+                break
+            if time.time() > deadline:
+                p.terminate()
+                r = dict(error = 'timed out after %d s' % timeout)
+                break
+    p.join()
+    return r
+# }}}
+
+def imports(n=10):
+# {{{
+    ''' Time to start a fresh interpreter and import each module (the best of n), and
+        the time of pyracc's first use of each backend, which imports its module. '''
+    def start(code):
+        t0 = time.time()
+        subprocess.check_call([sys.executable, '-c', code])
+        return time.time() - t0
+
+    tp = min([start('pass') for i in range(n)])
+    print '%-28s %9.1f ms' % ('interpreter', 1e3 * tp)
+    for mod in ['numpy', 'params', 'pyracc', 'pyr_rrtmg', 'pyr_rrtm', 'pyr_zh']:
+        t = min([start('import %s' % mod) for i in range(n)])
+        print '%-28s %9.1f ms' % ('import ' + mod, 1e3 * (t - tp))
+
+    for k in ['RRTMG', 'RRTM', 'EMUL']:
+        code = 'import pyracc, time; t0 = time.time(); pyracc.backend(pyracc.lwprms, %r); print time.time() - t0' % k
+        try: t = min([float(subprocess.check_output([sys.executable, '-c', code])) for i in range(n)])
+        except subprocess.CalledProcessError:
+            print '%-28s %12s' % ('first use ' + k, 'unavailable')
+            continue
+        print '%-28s %9.1f ms' % ('first use ' + k, 1e3 * t)
+# }}}
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ['suite']:
+        suite()
+    elif sys.argv[1:] == ['imports']:
+        imports()
+    else:
+        parse()
+        attrs()
+        zh()
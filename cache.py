@@ -0,0 +1,162 @@
+import numpy as np
+import collections, hashlib, os, threading
+
+class RunCache():
+# {{{
+    ''' Content-addressed cache of radiative transfer results, with one entry per profile.
+
+        Entries are keyed by a hash of the profile's active input parameters together
+        with the parameterization's cache key (see RadParams._cachekey), by default its
+        class and version. The most recently used maxsize entries are kept in memory;
+        if path is given, entries are also stored there as .npy files and read back on
+        a miss in memory. A cache may be shared by runs
+        in several threads, such as the longwave and shortwave runs of a pyracc.Suite. '''
+
+    def __init__(self, maxsize=4096, path=None):
+    # {{{
+        self.maxsize = maxsize
+        self.path    = path
+        self.entries = collections.OrderedDict()
+
+        self.hits     = 0
+        self.misses   = 0
+        self.diskhits = 0
+
+        # Guards the store, its order and the counters; held while entries are written to disk
+        self._lock    = threading.RLock()
+
+        if path is not None and not os.path.isdir(path): os.makedirs(path)
+    # }}}
+
+    def __len__(self):
+    # {{{
+        return len(self.entries)
+    # }}}
+
+    def __repr__(self):
+    # {{{
+        return '<RunCache: %d entries, %d hits (%d from disk), %d misses>' % \
+            (len(self.entries), self.hits, self.diskhits, self.misses)
+    # }}}
+
+    def clear(self):
+    # {{{
+        ''' Empty the in-memory store and reset counters. Entries on disk are kept. '''
+        with self._lock:
+            self.entries.clear()
+            self.hits = self.misses = self.diskhits = 0
+    # }}}
+
+    @staticmethod
+    def keys(prm, idx=None):
+    # {{{
+        ''' Hashes of the inputs of profiles idx (by default all) of prm. '''
+        Np   = prm.Np
+        if idx is None: idx = np.arange(Np)
+        if len(idx) == 0: return []
+        vals = prm.__getstate__()['_params']
+
+        # Common part: parameterization, and all parameters not defined per profile
+        base = hashlib.sha1('%s;' % prm._cachekey())
+        cols = []
+        for k in sorted(vals.keys()):
+            v = vals[k]
+            if hasattr(v, 'shape') and v.ndim > 0 and v.shape[0] == Np:
+                base.update('%s %s %s;' % (k, v.dtype.str, v.shape[1:]))
+                cols.append(np.ascontiguousarray(v[idx]).reshape(len(idx), -1).view(np.uint8))
+            else:
+                base.update('%s=%r;' % (k, v))
+
+        cols = np.ascontiguousarray(np.concatenate(cols, axis=1))
+
+        keys = []
+        for row in cols:
+            h = base.copy()
+            h.update(row.tostring())
+            keys.append(h.hexdigest())
+
+        return keys
+    # }}}
+
+    def _fn(self, key):
+    # {{{
+        return os.path.join(self.path, key + '.npy')
+    # }}}
+
+    def _get(self, key):
+    # {{{
+        if key in self.entries:
+            v = self.entries.pop(key)
+            self.entries[key] = v
+            return v
+
+        if self.path is not None and os.path.exists(self._fn(key)):
+            v = np.load(self._fn(key))
+            self._put(key, v, disk=False)
+            self.diskhits += 1
+            return v
+
+        return None
+    # }}}
+
+    def _put(self, key, v, disk=True):
+    # {{{
+        self.entries.pop(key, None)
+        self.entries[key] = v
+        while len(self.entries) > self.maxsize: self.entries.popitem(last=False)
+
+        if disk and self.path is not None and not os.path.exists(self._fn(key)):
+            # Write to a temporary file first so that concurrent readers never see partial entries
+            tmp = self._fn(key) + '.%d.%d' % (os.getpid(), threading.current_thread().ident)
+            with open(tmp, 'wb') as f: np.save(f, v)
+            os.rename(tmp, self._fn(key))
+    # }}}
+
+    @staticmethod
+    def _fields(prm, rd):
+    # {{{
+        fields = []
+        for out in prm._outsets(rd):
+            for l in out._lists:
+                if not l.active: continue
+                fields += [l.prm_dict[k].value for k in sorted(l.prm_dict.keys())]
+        return fields
+    # }}}
+
+    def fetch(self, prm, rd, idx=None):
+    # {{{
+        ''' Fill cached profiles among idx (by default all) of prm into output object rd.
+            Returns the indices of profiles which must be computed, and a dict of the
+            keys of profiles idx. '''
+        if idx is None: idx = np.arange(prm.Np)
+        keys   = dict(zip(idx, self.keys(prm, idx)))
+        fields = self._fields(prm, rd)
+
+        miss = []
+        with self._lock:
+            for i in idx:
+                v = self._get(keys[i])
+                if v is None:
+                    miss.append(i)
+                    continue
+
+                o = 0
+                for f in fields:
+                    n = f[i].size
+                    f[i] = v[o:o + n].reshape(f[i].shape)
+                    o += n
+
+            self.hits   += len(idx) - len(miss)
+            self.misses += len(miss)
+        return np.array(miss, 'i'), keys
+    # }}}
+
+    def store(self, prm, rd, idx, keys):
+    # {{{
+        ''' Store computed profiles idx of output object rd. '''
+        fields = self._fields(prm, rd)
+        vals   = [np.concatenate([f[i].ravel() for f in fields]) for i in idx]
+        with self._lock:
+            for i, v in zip(idx, vals): self._put(keys[i], v)
+    # }}}
+# }}}
@@ -0,0 +1,91 @@
+import time, threading
+
+class Timing():
+# {{{
+    ''' Wall clock time and number of calls of each phase of a run, and counters of
+        events such as files written or processes launched.
+
+        Phases may be timed from several threads at once, in which case their times
+        add up. If callback is given it is called as callback(phase, seconds) each
+        time a phase completes, e.g. to forward timings to an external profiler. '''
+
+    def __init__(self, callback=None):
+    # {{{
+        self.callback = callback
+        self.times    = {}
+        self.calls    = {}
+        self.counts   = {}
+        self._lock    = threading.Lock()
+    # }}}
+
+    def __repr__(self):
+    # {{{
+        return '<Timing: %s>' % ', '.join(['%s %.3g s' % (k, self.times[k]) for k in sorted(self.times)])
+    # }}}
+
+    def phase(self, name):
+    # {{{
+        ''' Context manager timing the enclosed code as phase name. '''
+        return _Phase(self, name)
+    # }}}
+
+    def add(self, name, seconds):
+    # {{{
+        with self._lock:
+            self.times[name] = self.times.get(name, 0.) + seconds
+            self.calls[name] = self.calls.get(name, 0) + 1
+        if self.callback is not None: self.callback(name, seconds)
+    # }}}
+
+    def count(self, name, n=1):
+    # {{{
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + n
+    # }}}
+
+    def report(self):
+    # {{{
+        ''' Table of phases and counters as a string. '''
+        s = '%-14s %10s %8s\n' % ('phase', 'seconds', 'calls')
+        for k in sorted(self.times):
+            s += '%-14s %10.4f %8d\n' % (k, self.times[k], self.calls[k])
+        for k in sorted(self.counts):
+            s += '%-14s %19d\n' % (k, self.counts[k])
+        return s[:-1]
+    # }}}
+# }}}
+
+class _Phase():
+# {{{
+    def __init__(self, timing, name):
+        self.timing = timing
+        self.name   = name
+
+    def __enter__(self):
+        self.t0 = time.time()
+
+    def __exit__(self, *exc):
+        self.timing.add(self.name, time.time() - self.t0)
+# }}}
+
+class NoTiming():
+# {{{
+    ''' Stand-in for Timing when a run is not instrumented; records nothing. '''
+    def __enter__(self): pass
+    def __exit__(self, *exc): pass
+    def phase(self, name): return self
+    def add(self, name, seconds): pass
+    def count(self, name, n=1): pass
+# }}}
+
+notiming = NoTiming()
+
+def start(timing):
+# {{{
+    ''' Timing object for the timing argument of a run: None or False (no timing), True,
+        a callback for a new Timing, or an existing Timing to accumulate into. '''
+    if not timing: return notiming
+    if isinstance(timing, Timing): return timing
+    if timing is True: return Timing()
+    return Timing(callback=timing)
+# }}}
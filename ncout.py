@@ -0,0 +1,107 @@
+import numpy as np
+import os, struct
+from params import nctmap
+
+class NCWriter():
+# {{{
+    ''' Netcdf file to which the results of successive runs are appended, e.g. the chunks
+        yielded by RadParams.run_stream, along an unlimited profiles dimension.
+
+        Each call of append() writes the outputs of a run and, if inputs is True, the
+        per-profile inputs of the parameter set they were computed from. The file
+        is written with the scipy netcdf module on the first call; later calls write
+        the new records to the end of the file, so no more than one chunk is held
+        in memory. Variables carry the dimensions and units attributes of their
+        parameters, so that files can be read with RadParams.from_nc. '''
+
+    def __init__(self, fn, inputs=False, overwrite=False):
+    # {{{
+        if os.path.exists(fn) and not overwrite:
+            raise IOError('%s already exists; pass overwrite=True to replace it.' % fn)
+
+        self.fn      = fn
+        self.inputs  = inputs
+        self.Np      = 0        # Number of profiles written
+        self.names   = None     # Record variables in the order of their records in the file
+    # }}}
+
+    def __repr__(self):
+    # {{{
+        return '<NCWriter: %s, %d profiles>' % (self.fn, self.Np)
+    # }}}
+
+    def _fields(self, rd, prm):
+    # {{{
+        # Parameters defined per profile of each output set and, optionally, of the inputs
+        sets = list(prm._outsets(rd))
+        if self.inputs: sets.append(prm)
+
+        fields = {}
+        for pset in sets:
+            for k, p in pset._index.iteritems():
+                if p.ncaxes is None or p.ncaxes[0] != 'profiles' or fields.has_key(k): continue
+                fields[k] = p
+        return fields
+    # }}}
+
+    def append(self, rd, prm):
+    # {{{
+        ''' Append the profiles of output object rd, computed by parameter set prm
+            (from its first profiles, if rd holds fewer). '''
+        fields = self._fields(rd, prm)
+        # Inputs may hold more profiles than a chunk run by run_stream
+        n = len(prm._outsets(rd)[0]._index.values()[0].value)
+
+        if self.names is None:
+            self._create(fields, prm, n)
+        else:
+            # Records hold one profile of every record variable, in file order
+            recs = [np.arange(self.Np, self.Np + n).astype('>i4').reshape(n, 1).view('>u1')]
+            for k in self.names[1:]:
+                recs.append(np.asarray(fields[k].value[:n], '>f8').reshape(n, -1).view('>u1'))
+
+            with open(self.fn, 'r+b') as f:
+                f.seek(0, 2)
+                f.write(np.concatenate(recs, axis=1).tostring())
+
+                # Record count follows the magic number and version byte
+                f.seek(4)
+                f.write(struct.pack('>i', self.Np + n))
+
+        self.Np += n
+    # }}}
+
+    def _create(self, fields, prm, n):
+    # {{{
+        from scipy.io import netcdf as nc
+
+        Nl = prm.Nl
+        with nc.netcdf_file(self.fn, 'w') as f:
+            # The unlimited dimension must be the first defined
+            f.createDimension('profiles', None)
+            f.createVariable('profiles', 'i', ('profiles',))[:n] = np.arange(n)
+
+            for d, m in [('levels', Nl), ('hlevels', Nl + 1)]:
+                f.createDimension(d, m)
+                f.createVariable(d, 'i', (d,))[:] = np.arange(m)
+
+            if self.inputs:
+                # Scalar inputs are written as attributes of the file
+                for k, p in sorted(prm._index.iteritems()):
+                    if p.ncaxes is None: f.__setattr__(k, p.value)
+
+            for k, p in sorted(fields.iteritems()):
+                v = f.createVariable(k, nctmap[p.dtype], p.ncaxes)
+                v[:n] = p.value[:n]
+                if p.units is not None: v.units = p.units
+
+        # Records are laid out in the order the variables appear in the header
+        with nc.netcdf_file(self.fn, 'r', mmap=False) as f:
+            names = [k for k, v in f.variables.iteritems() if v.isrec]
+
+        # Appending assumes the profile index comes first and all other fields are doubles
+        if names[0] != 'profiles' or any([fields[k].ncdtype != 'd' for k in names[1:]]):
+            raise ValueError('Unexpected layout of records in %s.' % self.fn)
+        self.names = names
+    # }}}
+# }}}
@@ -1,4 +1,5 @@
 import numpy as np
+import instrument, background, regrid
 
 nctmap = {np.int64 : 'i', np.float64 : 'd'}
 
@@ -15,7 +16,7 @@ class Param():
         self.units = units
         self.ncaxes = ncaxes
         if (hasattr(default, '__len__') and type(default) is not str):
-            self.value = default.copy()
+            self.value = default.copy('K')
         else: 
             self.value = default
 
@@ -65,6 +66,9 @@ class Param():
 
     def _gettype(self, value):
     # {{{
+        # Numerical arrays are all taken as floating point, as for their elements below
+        if isinstance(value, np.ndarray) and value.size > 0 and value.dtype.kind in 'biuf': return np.float64
+
         if (hasattr(value, '__len__') and type(value) is not str): v = np.ravel(value)[0]
         else: v = value
 
@@ -83,21 +87,69 @@ class Param():
         else: return not self.value == self.default
     # }}}
 
-    def setv(self, value):
-    # {{{ 
+    def _check(self, value, idx=None):
+    # {{{
+        ''' Validate value for assignment to this parameter, or to the profiles idx of it
+            if given. Returns the value in a form that can be assigned in place. '''
         vdtype = self._gettype(value)
         if vdtype != self.dtype:
             raise AttributeError('Parameter %s is a %s, received a %s.' % \
                 (self.name, self.dtype.__name__, vdtype.__name__))
-        if hasattr(self.default, '__len__'):
-            if hasattr(value, '__len__') and value.ndim == 1 and len(value) in self.default.shape:
-                shp = np.ones(self.default.ndim, 'i')
-                shp[self.default.shape.index(len(value))] = -1
-                self.value[:] = value.reshape(*shp)
-            else:
-                self.value[:] = value
-        else:
-            self.value = value
+
+        if not hasattr(self.default, '__len__'):
+            if idx is not None:
+                raise ValueError('Parameter %s is a scalar and has no profiles to set.' % self.name)
+            return value
+
+        shape = self.value.shape
+        if idx is not None: shape = (len(np.arange(shape[0])[idx]),) + shape[1:]
+
+        # One dimensional arrays are laid along the axis whose length they match
+        if hasattr(value, '__len__') and value.ndim == 1 and len(value) in shape:
+            shp = np.ones(len(shape), 'i')
+            shp[shape.index(len(value))] = -1
+            value = value.reshape(*shp)
+
+        try: np.broadcast_to(value, shape)
+        except ValueError:
+            raise ValueError('Parameter %s has shape %s, received a value of shape %s.' % \
+                (self.name, shape, np.shape(value)))
+        return value
+    # }}}
+
+    def _assign(self, v, idx=None):
+    # {{{
+        ''' Store v, as returned by _check(), into this parameter or its profiles idx. '''
+        self.pset._touch(self, v, idx)
+        if idx is not None: self.value[idx] = v
+        elif hasattr(self.default, '__len__'): self.value[:] = v
+        else: self.value = v
+    # }}}
+
+    def setv(self, value):
+    # {{{ 
+        self._assign(self._check(value))
+        if self.trigger is not None: self.trigger(value, self.pset)
+    # }}}
+
+    def bind(self, value):
+    # {{{
+        ''' Adopt array value as the storage of this parameter, without copying. '''
+        if not hasattr(self.value, 'shape'):
+            raise AttributeError('Parameter %s is a scalar and cannot be bound to an array.' % self.name)
+        if not isinstance(value, np.ndarray):
+            raise TypeError('Parameter %s can only be bound to a numpy array.' % self.name)
+        if value.dtype != self.dtype:
+            raise AttributeError('Parameter %s is a %s, received a %s array.' % \
+                (self.name, self.dtype.__name__, value.dtype.name))
+        if value.shape != self.value.shape:
+            raise ValueError('Parameter %s has shape %s, received an array of shape %s.' % \
+                (self.name, self.value.shape, value.shape))
+        if not (value.flags.c_contiguous or value.flags.f_contiguous):
+            raise ValueError('Parameter %s can only be bound to a contiguous array.' % self.name)
+
+        self.pset._touch(self, value)
+        self.value = value
         if self.trigger is not None: self.trigger(value, self.pset)
     # }}}
 # }}}  
@@ -163,7 +215,10 @@ class Namelist():
 
     def __setattr__(self, name, value):
       # {{{
-      if self.__dict__.has_key(name): self.__dict__[name] = value
+      if self.__dict__.has_key(name):
+        self.__dict__[name] = value
+        # Parameters of an inactive list are not visible from the parameter set
+        if name == 'active': self.pset._reindex()
       else: self.prm_dict[name].setv(value)
 # }}}
 
@@ -179,6 +234,7 @@ class ParamSet():
     def __init__(self, name, lists, **kwargs):
       # {{{
       self.__dict__['_lists'] = lists
+      self._reindex()
       self.set_name(name)
       for k, v in kwargs.iteritems():
         self.__setattr__(k, v)
@@ -188,11 +244,16 @@ class ParamSet():
       # {{{
       dict = self.__dict__.copy()
       lists = dict.pop('_lists')
+      dict.pop('_index')
+      dict.pop('_work', None)
+      dict.pop('_masks', None)
 
       prm = {}
       for l in lists:
         if not l.active: continue
         for k, v in l.prm_dict.iteritems():
+          # Parameters shadowed by an earlier list are not visible as attributes
+          if prm.has_key(k): continue
           if hasattr(v, '__len__'): 
             prm[k] = v.value.copy()
           else:
@@ -227,7 +288,7 @@ class ParamSet():
       ParamSet.__init__(cpy, cpy.name, lists)
 
       # Copy remainder of setup
-      spc = ['_lists']
+      spc = ['_lists', '_index', '_work', '_masks']
       for k, v in other.__dict__.iteritems():
         if k not in spc: cpy.__dict__[k] = v
 
@@ -251,21 +312,32 @@ class ParamSet():
         return lst
 # }}}
 
+    def _reindex(self):
+      # {{{
+      ''' Rebuild the index from attribute names to the Params of active lists. Where
+          lists share a parameter name, the first list takes precedence. '''
+      index = {}
+      for l in reversed(self._lists):
+        if l.active: index.update(l.prm_dict)
+      self.__dict__['_index'] = index
+# }}}
+
     def __getattr__(self, name):
       # {{{
+      p = self.__dict__['_index'].get(name)
+      if p is not None: return p.value
       for l in self._lists:
         if l.name == name: return l
-        if l.active and l.prm_dict.has_key(name): return l.__getattr__(name)
       raise AttributeError("'%s' object has no parameter '%s'" % (self.__class__.__name__, name))
 # }}}
 
     def __setattr__(self, name, value):
       # {{{
       # Look for attribute in parameter list
-      for l in [l for l in self._lists if l.active]:
-        if l.prm_dict.has_key(name): 
-          l.__setattr__(name, value)
-          return
+      p = self.__dict__['_index'].get(name)
+      if p is not None:
+        p.setv(value)
+        return
 
       if name == 'name':
         self.set_name(name)
@@ -275,6 +347,44 @@ class ParamSet():
         raise AttributeError("'%s' object has no parameter '%s'" % (self.__class__.__name__, name))
 # }}}
 
+    def _param(self, name):
+      # {{{
+      ''' Param object behind attribute name. '''
+      p = self.__dict__['_index'].get(name)
+      if p is not None: return p
+      raise AttributeError("'%s' object has no parameter '%s'" % (self.__class__.__name__, name))
+# }}}
+
+    def _touch(self, prm, value, idx=None):
+      # {{{
+      ''' Called with the new value before parameter prm (or its profiles idx) is set. '''
+      pass
+# }}}
+
+    def update(self, **kwargs):
+      # {{{
+      ''' Set several parameters at once, e.g. prm.update(T=t, H2O=q). All values are
+          validated before any is assigned. '''
+      prms = [(self._param(k), v) for k, v in kwargs.iteritems()]
+      vals = [p._check(v) for p, v in prms]
+      for (p, value), v in zip(prms, vals):
+        p._assign(v)
+        if p.trigger is not None: p.trigger(value, self)
+# }}}
+
+    def update_profiles(self, idx, **kwargs):
+      # {{{
+      ''' Set profiles idx (an index array or slice) of several parameters at once, e.g.
+          prm.update_profiles(idx, T=t, H2O=q) with t and q of shape (len(idx), Nl). Only
+          parameters defined per profile can be set. All values are validated before any
+          is assigned. '''
+      prms = [(self._param(k), v) for k, v in kwargs.iteritems()]
+      vals = [p._check(v, idx) for p, v in prms]
+      for p, v in zip([p for p, value in prms], vals):
+        p._assign(v, idx)
+        if p.trigger is not None: p.trigger(p.value, self)
+# }}}
+
     def force(self, name, value):
       # {{{
       for l in self._lists:
@@ -284,6 +394,15 @@ class ParamSet():
       raise AttributeError("'%s' object has no parameter '%s'" % (self.__class__.__name__, name))
 # }}}
 
+    def bind(self, **kwargs):
+      # {{{
+      ''' Use caller-owned arrays as parameter storage without copying, e.g. prm.bind(T=t, pres=p).
+          Arrays must match the shape and dtype of the parameter and be contiguous; the
+          parameter then sees all changes the caller makes to them, and vice versa. '''
+      for name, value in kwargs.iteritems():
+        self._param(name).bind(value)
+# }}}
+
     def set_name(self, name):
       # {{{
       self.__dict__['name'] = name
@@ -294,18 +413,78 @@ class ParamSet():
 class RadParams(ParamSet):
 # {{{
     ''' Container class for parameters and data required for column radiative transfer calculations. '''
+    version = 0     # Increment in a parameterization when its results change; keys cached results
+    _timing = instrument.notiming   # Records phases of the run in progress, if instrumented
+    _work   = None  # Work buffers kept between runs by a driver such as pyracc.Stepper, or None
+    _masks  = None  # Buffers for comparing old and new values of parameters, by shape
 
     # Define parameter model, serialization options
-    def __init__(self, name, Nl, Np=1, lists=[], **kwargs):
+    def __init__(self, name, Nl, Np=1, lists=[], order='C', columnar=False, **kwargs):
     # {{{
-        # By default include profiles of tracers, temperatures, pressures
-        lists = [consts(self), profile(self, Nl, Np), tracers(self, Nl, Np)] + lists
-        ParamSet.__init__(self, name, lists, **kwargs)
-
         self.__dict__['Nl'] = Nl
         self.__dict__['Np'] = Np
+
+        # Per profile count of input changes, and the counts and output of the last run.
+        # Changes are only tracked once an incremental run has asked for them.
+        self.__dict__['_pver']  = np.zeros(Np, 'i8')
+        self.__dict__['_last']  = None
+        self.__dict__['_track'] = False
+
+        # By default include profiles of tracers, temperatures, pressures. With order='F'
+        # these are allocated in Fortran order, as expected by compiled parameterizations.
+        lists = [consts(self), profile(self, Nl, Np, order), tracers(self, Nl, Np, order)] + lists
+        if columnar: self._columnar(lists)
+        ParamSet.__init__(self, name, lists, **kwargs)
     # }}}
 
+    def _columnar(self, lists):
+    # {{{
+        ''' Store all fields defined per profile and level in a single array columns, of
+            shape (Np, Nvar, Nl), so that the inputs of each profile are contiguous.
+            The parameters, named in order by colnames, become views of this array
+            (until rebound with bind()); order is not used for them. '''
+        shape = (self.Np, self.Nl)
+        prms  = []
+        for l in lists:
+            # Parameters shadowed by an earlier list are left as they are
+            prms += [p for p in sorted(l.prm_dict.values(), key=lambda p: p._order) \
+                        if hasattr(p.value, 'shape') and p.value.shape == shape \
+                        and p.name not in [q.name for q in prms]]
+
+        cols = np.empty((self.Np, len(prms), self.Nl), 'd')
+        for j, p in enumerate(prms):
+            cols[:, j, :] = p.value
+            p.value = cols[:, j, :]
+
+        self.__dict__['columns']  = cols
+        self.__dict__['colnames'] = [p.name for p in prms]
+    # }}}
+
+    def _touch(self, prm, value, idx=None):
+        # Parameters defined per profile mark the profiles they change; others all profiles
+        if not self._track: return
+        old = prm.value
+        if hasattr(old, 'shape') and old.ndim > 0 and old.shape[0] == self.Np:
+            if idx is None:
+                # Compare into a buffer kept for arrays of this shape
+                if self._masks is None: self.__dict__['_masks'] = {}
+                if not self._masks.has_key(old.shape): self._masks[old.shape] = np.empty(old.shape, bool)
+                mask = self._masks[old.shape]
+                np.not_equal(old, value, out=mask)
+                self._pver[np.any(mask.reshape(self.Np, -1), axis=1)] += 1
+            else:
+                prof = np.arange(self.Np)[idx]
+                self._pver[prof[np.any(np.not_equal(old[idx], value).reshape(len(prof), -1), axis=1)]] += 1
+        elif np.any(old != value):
+            self._pver[:] += 1
+
+    def touch(self, idx=None):
+        ''' Mark profiles idx (by default all) as changed. Changes made through parameter
+            assignment are tracked automatically; this is needed after modifying the
+            contents of arrays bound with bind(). '''
+        if idx is None: idx = slice(None)
+        self._pver[idx] += 1
+
     def set_tracer(self, unit='ppmv', **kwargs):
         '''Sets tracer profiles. Performs unit conversions if need be.'''
         pass
@@ -313,41 +492,249 @@ class RadParams(ParamSet):
     def write_ascii(self):
         pass
 
-    def write_nc(self, fn):
+    def write_nc(self, fn, overwrite=False):
+        ''' Write parameters to netcdf file fn; see also ncout.NCWriter. An existing
+            file is only replaced if overwrite is True. '''
         from scipy.io import netcdf as nc
         import os
         
-        if os.path.exists(fn):
-            ans = raw_input('%s already exists. Overwrite? y/[n]: ' % fn)
-            if ans != 'y': return
+        if os.path.exists(fn) and not overwrite:
+            raise IOError('%s already exists; pass overwrite=True to replace it.' % fn)
 
         with nc.netcdf_file(fn, 'w') as f:
-            f.createDimension('levels', self.Nl)
-            f.createDimension('hlevels', self.Nl+1)
-            f.createDimension('profiles', self.Np)
+            for d, n in [('levels', self.Nl), ('hlevels', self.Nl + 1), ('profiles', self.Np)]:
+                f.createDimension(d, n)
+                f.createVariable(d, 'i', (d,))[:] = np.arange(n)
+
+            # Parameters visible as attributes; those of inactive or shadowed lists are not written
+            for p, prm in sorted(self._index.iteritems()):
+                if prm.ncaxes is None:
+                    # Scalar value, add as attribute to file
+                    f.__setattr__(p, prm.value)
+                else:
+                    v = f.createVariable(p, nctmap[prm.dtype], prm.ncaxes)
+                    v[:] = prm.value
+                    if prm.units is not None: v.units = prm.units
+
+    @classmethod
+    def from_nc(cls, fn, profiles=None, **kwargs):
+        ''' Construct a parameter set from profiles (a slice or index array; by default
+            all) of netcdf file fn, as written by write_nc. The file is memory mapped so
+            that only the selected profiles are read; datasets larger than memory can be
+            processed a slice at a time. Keyword arguments are passed to the constructor
+            and take precedence over values in the file. Only defined for
+            parameterizations constructed as cls(Nl, Np, **kwargs). '''
+        from scipy.io import netcdf as nc
+
+        with nc.netcdf_file(fn, 'r', mmap=True) as f:
+            Nl = f.dimensions['levels']
+            # An unlimited profiles dimension has no fixed size
+            Np = f.variables['profiles'].shape[0]
+
+            if profiles is None: profiles = slice(None)
+            prm = cls(Nl, len(np.arange(Np)[profiles]), **kwargs)
+
+            scalars, arrays = {}, {}
+            for k, p in prm._index.iteritems():
+                if kwargs.has_key(k): continue
+                if p.ncaxes is None and f._attributes.has_key(k):
+                    v = f._attributes[k]
+                    # Attributes are read as numpy types; parameters take native ones
+                    scalars[k] = v.item() if hasattr(v, 'item') else v
+                elif p.ncaxes is not None and f.variables.has_key(k):
+                    # Only the selected profiles are paged in from the mapped file
+                    arrays[k] = f.variables[k].data[profiles]
+
+            prm.update(**scalars)
+            prm.update(**arrays)
 
-            levels = f.createVariable('levels', 'i', ('levels',))
-            levels = np.arange(self.Nl)
+            # References to mapped data must be released before the file is closed
+            del arrays
 
-            hlevels = f.createVariable('levels', 'i', ('hlevels',))
-            hlevels = np.arange(self.Nl + 1)
+        return prm
 
-            profiles = f.createVariable('profiles', 'i', ('profiles',))
-            profiles = np.arange(self.Np)
 
-            for l in self._lists:
-                for p, prm in l.prm_dict.iteritems():
-                    if prm.ncaxes is None:
-                        # Scalar value, add as attribute to file
-                        f.__setattr__(p, prm.value)
-                    else:
-                        v = f.createVariable(p, nctmap[prm.dtype], prm.ncaxes)
-                        v[:] = prm.value
+    def _alloc(self):
+        ''' Allocate output object. '''
+        raise NotImplementedError
 
+    def _outsets(self, rd):
+        ''' List of output ParamSets held by output object rd. '''
+        return [rd]
 
-    def run(self):
-        ''' Execute calculation on profile data. '''
+    def _prepare(self):
+        ''' Compute fields derived from the inputs, before any profile is run. '''
         pass
+
+    def _compute(self, rd, idx, **kwargs):
+        ''' Compute profiles idx into output object rd. '''
+        raise NotImplementedError
+
+    def _cachekey(self):
+        ''' Identifies the parameterization in cache keys, along with its inputs. Extend in
+            parameterizations whose results depend on state other than their parameters. '''
+        return '%s.%s %s' % (self.__class__.__module__, self.__class__.__name__, self.version)
+
+    def run(self, cache=None, prepare=True, incremental=False, out=None, timing=None, **kwargs):
+        ''' Execute calculation on profile data. Profiles found in cache (a cache.RunCache)
+            are not recomputed; other keyword arguments are passed to the parameterization.
+            prepare=False skips recomputing derived fields, e.g. if they are shared with
+            another parameter set which has already done so. With incremental=True only
+            profiles whose inputs changed since the last run are computed; the others
+            are copied from the output of that run. Changes to the inputs are only
+            tracked from the first incremental run on, which computes all profiles. Results are written into out, an
+            output object from a previous run or from _alloc(), if one is given.
+            With timing=True (or a callback, or an instrument.Timing to add to) the time
+            spent in each phase of the run and counters of files written, processes
+            launched etc. are recorded in an instrument.Timing, attached to each output
+            set as its timing attribute. '''
+        tm = instrument.start(timing)
+        self.__dict__['_timing'] = tm
+        try:
+            with tm.phase('run'):
+                with tm.phase('alloc'):
+                    rd = self._alloc() if out is None else out
+
+                if incremental: self.__dict__['_track'] = True
+
+                idx = np.arange(self.Np)
+                if incremental and self._last is not None:
+                    last, pver = self._last
+                    idx = np.where(self._pver != pver)[0]
+                    for o, l in zip(self._outsets(rd), self._outsets(last)):
+                        if o is l: continue
+                        for k in o._lists[0].prm_dict.keys(): getattr(o, k)[:] = getattr(l, k)
+
+                self._run(rd, idx, cache, prepare, kwargs)
+        finally:
+            del self.__dict__['_timing']
+
+        if tm is not instrument.notiming:
+            for o in self._outsets(rd): o.__dict__['timing'] = tm
+
+        if self._track: self.__dict__['_last'] = (rd, self._pver.copy())
+        return rd
+
+    def _run(self, rd, idx, cache, prepare, kwargs):
+        ''' Prepare, and compute profiles idx into rd that are not found in cache, timing
+            each phase in the run's Timing. '''
+        tm = self._timing
+        if prepare:
+            with tm.phase('prepare'): self._prepare()
+
+        if cache is not None:
+            with tm.phase('cache'): idx, keys = cache.fetch(self, rd, idx)
+
+        tm.count('columns', len(idx))
+        if len(idx) > 0:
+            with tm.phase('compute'): self._compute(rd, idx, **kwargs)
+
+        if cache is not None:
+            with tm.phase('cache'): cache.store(self, rd, idx, keys)
+
+    def submit(self, **kwargs):
+        ''' Start run(**kwargs) in a background thread and return a Future of its output,
+            so that other work can proceed meanwhile; the ascii backends and compiled
+            codes do not hold the interpreter while they compute. Inputs must not be
+            changed, nor another run of this parameter set started, until it is done.
+            Executables are run in scratch directories (see pyr_ascii.AsciiRun._dispatch)
+            unless a scratch root is given, so that runs submitted together do not
+            share a working directory. '''
+        import pyr_ascii, tempfile
+        if isinstance(self, pyr_ascii.AsciiRun) and kwargs.get('scratch') is None:
+            kwargs['scratch'] = tempfile.gettempdir()
+        return background.submit(self.run, **kwargs)
+
+    def run_stream(self, source, chunk=None, cache=None, prepare=True, timing=None, **kwargs):
+        ''' Run on a stream of profiles, yielding an output object for each chunk of at
+            most chunk (by default Np) profiles as it is computed. source is an iterable
+            of dicts of per-profile parameter values for any number of profiles, or of
+            parameter sets (e.g. read with from_nc). This parameter set is the working
+            storage: the profiles of a chunk are copied into its first profiles, and
+            parameters not given by the source keep their values. Memory use is
+            therefore bounded by Np however long the stream. cache, prepare and timing
+            are as for run(), a single Timing accumulating over all chunks; each
+            chunk is computed in full into a new output object, so incremental and
+            out are not accepted. Other keyword arguments are passed to the
+            parameterization. '''
+        for k in ['incremental', 'out']:
+            if kwargs.has_key(k):
+                raise TypeError('run_stream() does not accept %s; each chunk is computed in full into a new output object.' % k)
+        if chunk is None: chunk = self.Np
+        if not 0 < chunk <= self.Np:
+            raise ValueError('chunk must be between 1 and Np = %d; received %d.' % (self.Np, chunk))
+
+        tm = instrument.start(timing)
+
+        for item in source:
+            if isinstance(item, ParamSet):
+                item = dict([(k, p.value) for k, p in item._index.iteritems() \
+                                if hasattr(p.value, 'shape') and p.value.ndim > 0 \
+                                and p.value.shape[0] == item.Np and self._index.has_key(k)])
+
+            N = len(item.values()[0])
+            for b in range(0, N, chunk):
+                n = min(chunk, N - b)
+                self.update_profiles(slice(0, n), **dict([(k, v[b:b + n]) for k, v in item.iteritems()]))
+
+                # The stream may be suspended between chunks, so the Timing is only set while computing
+                self.__dict__['_timing'] = tm
+                try:
+                    with tm.phase('run'):
+                        with tm.phase('alloc'): rd = self._alloc()
+                        self._run(rd, np.arange(n), cache, prepare, kwargs)
+                finally:
+                    del self.__dict__['_timing']
+
+                # Outputs of a partial chunk are trimmed to the profiles computed
+                for o in self._outsets(rd):
+                    if n < self.Np:
+                        for p in o._index.values(): p.value = p.value[:n]
+                    if tm is not instrument.notiming: o.__dict__['timing'] = tm
+
+                yield rd
+
+    def run_coarse(self, ratio=2, diagnose=False, **kwargs):
+        ''' Run on a grid coarser by ratio, each of its layers merging ratio native
+            layers (see regrid.halflevels), and map the output back onto the native
+            levels. Inputs are remapped conservatively in pressure using phalf; fluxes
+            are interpolated linearly in pressure, heating rates are constant over each
+            coarse layer. With diagnose=True the native grid is run as well, and the
+            differences of each field, overall and per level (see regrid.errors and
+            regrid.report), are attached to each output set as its diagnostics
+            attribute. Other keyword arguments are passed to the runs. Only defined
+            for parameterizations constructed as cls(Nl, Np), and not for those
+            compiled for a fixed number of levels, such as ZH. '''
+        hi = regrid.halflevels(self.Nl, ratio)
+        ph = self.phalf
+        layer, half = (self.Np, self.Nl), (self.Np, self.Nl + 1)
+
+        crs = self.__class__(len(hi) - 1, self.Np)
+        vals = {}
+        for k, p in self._index.iteritems():
+            if not crs._index.has_key(k): continue
+            shape = getattr(p.value, 'shape', None)
+            if shape == layer:  vals[k] = regrid.layers(p.value, ph, hi)
+            elif shape == half: vals[k] = p.value[:, hi]
+            else:               vals[k] = p.value
+        crs.update(**vals)
+
+        rc = crs.run(**kwargs)
+        rd = self._alloc()
+        for o, c in zip(self._outsets(rd), self._outsets(rc)):
+            for k, p in o._index.iteritems():
+                shape = getattr(p.value, 'shape', None)
+                if shape == layer:  p.value[:] = regrid.expand(getattr(c, k), hi)
+                elif shape == half: p.value[:] = regrid.interp(getattr(c, k), ph, hi)
+                else:               p.value[...] = getattr(c, k)
+
+        if diagnose:
+            full = self.run(**kwargs)
+            for o, f in zip(self._outsets(rd), self._outsets(full)):
+                o.__dict__['diagnostics'] = dict([(k, regrid.errors(getattr(o, k), getattr(f, k))) \
+                    for k, p in o._index.iteritems() if getattr(p.value, 'shape', None) in [layer, half]])
+
+        return rd
 # }}}
 
 class LW(RadParams):
@@ -362,6 +749,9 @@ class LW(RadParams):
 
     def _lwout(self):
         return LWOut(self.prmname, self.Nl, self.Np)
+
+    def _alloc(self):
+        return self._lwout()
 # }}}
 
 class LWOut(ParamSet):
@@ -386,6 +776,9 @@ class SW(RadParams):
 
     def _swout(self):
         return SWOut(self.prmname, self.Nl, self.Np)
+
+    def _alloc(self):
+        return self._swout()
 # }}}
 
 class SWOut(ParamSet):
@@ -398,9 +791,9 @@ class SWOut(ParamSet):
         ParamSet.__init__(self, name, lists, **kwargs)
 # }}}
 
-def tracers(pset, Nl, Nprof):
+def tracers(pset, Nl, Nprof, order='C'):
 # {{{
-    one = np.ones((Nprof, Nl), 'd')
+    one = np.ones((Nprof, Nl), 'd', order)
     ncax = ('profiles', 'levels')
     return Namelist('tracers', \
         [Param('H2O', 3.e-6   * one, units = 'mol/mol', ncaxes=ncax),\
@@ -413,22 +806,22 @@ def tracers(pset, Nl, Nprof):
         pset)
 # }}}
 
-def profile(pset, Nl, Nprof):
+def profile(pset, Nl, Nprof, order='C'):
 # {{{
     Nhl = Nl + 1
-    one  = np.ones((Nprof, Nl), 'd')
-    oneh = np.ones((Nprof, Nhl), 'd')
+    one  = np.ones((Nprof, Nl), 'd', order)
+    oneh = np.ones((Nprof, Nhl), 'd', order)
     onep = np.ones(Nprof, 'd')
     ncax  = ('profiles', 'levels')
     ncaxh = ('profiles', 'hlevels')
     ncaxp = ('profiles',)
     return Namelist('profile', \
-        [Param('pres',          one,  ncaxes=ncax),\
-         Param('phalf',        oneh, ncaxes=ncaxh),\
-         Param('lat',     0. * onep,  ncaxes=ncaxp),\
-         Param('lon',     0. * onep,  ncaxes=ncaxp),\
-         Param('T',      250. * one,  ncaxes=ncax),\
-         Param('Tsfc',  250. * onep, ncaxes=ncaxp)],\
+        [Param('pres',          one,  units = 'hPa', ncaxes=ncax),\
+         Param('phalf',        oneh, units = 'hPa', ncaxes=ncaxh),\
+         Param('lat',     0. * onep,  units = 'degrees_north', ncaxes=ncaxp),\
+         Param('lon',     0. * onep,  units = 'degrees_east', ncaxes=ncaxp),\
+         Param('T',      250. * one,  units = 'K', ncaxes=ncax),\
+         Param('Tsfc',  250. * onep, units = 'K', ncaxes=ncaxp)],\
         pset)
 # }}}
 
@@ -457,10 +850,12 @@ def lwbase(pset, Nl, Nprof):
 def lwout(pset, Nl, Nprof):
 # {{{
     Nhl = Nl + 1
+    ncax  = ('profiles', 'levels')
+    ncaxh = ('profiles', 'hlevels')
     return Namelist('lwout', \
-        [Param('lwhr',   np.zeros((Nprof, Nl ), 'd')),\
-         Param('uflxlw', np.zeros((Nprof, Nhl), 'd')),\
-         Param('dflxlw', np.zeros((Nprof, Nhl), 'd'))],\
+        [Param('lwhr',   np.zeros((Nprof, Nl ), 'd'), units = 'K/day', ncaxes=ncax),\
+         Param('uflxlw', np.zeros((Nprof, Nhl), 'd'), units = 'W/m2',  ncaxes=ncaxh),\
+         Param('dflxlw', np.zeros((Nprof, Nhl), 'd'), units = 'W/m2',  ncaxes=ncaxh)],\
         pset)
 # }}}
 
@@ -479,9 +874,11 @@ def swbase(pset, Nl, Nprof):
 def swout(pset, Nl, Nprof):
 # {{{
     Nhl = Nl + 1
+    ncax  = ('profiles', 'levels')
+    ncaxh = ('profiles', 'hlevels')
     return Namelist('swout', \
-        [Param('swhr',   np.zeros((Nprof, Nl ), 'd')),\
-         Param('uflxsw', np.zeros((Nprof, Nhl), 'd')),\
-         Param('dflxsw', np.zeros((Nprof, Nhl), 'd'))],\
+        [Param('swhr',   np.zeros((Nprof, Nl ), 'd'), units = 'K/day', ncaxes=ncax),\
+         Param('uflxsw', np.zeros((Nprof, Nhl), 'd'), units = 'W/m2',  ncaxes=ncaxh),\
+         Param('dflxsw', np.zeros((Nprof, Nhl), 'd'), units = 'W/m2',  ncaxes=ncaxh)],\
         pset)
 # }}}
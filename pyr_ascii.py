@@ -0,0 +1,201 @@
+import numpy as np
+import subprocess, os, shutil, tempfile, threading, Queue
+import multiprocessing, re
+
+# Locks of files shared by concurrent runs, by absolute path; see AsciiRun._dispatch
+_locks     = {}
+_locks_mod = threading.Lock()
+
+def _lock(path):
+# {{{
+    with _locks_mod:
+        return _locks.setdefault(os.path.abspath(path), threading.Lock())
+# }}}
+
+# Fields a fortran format could not fit are printed as asterisks
+overflow = re.compile(r'\*+')
+
+def read_columns(fn, nrows, ncols, skip_header=0):
+# {{{
+    ''' Read nrows rows of ncols whitespace-separated numbers from fortran output fn,
+        starting after skip_header lines. Overflowed fields are read as NaN. '''
+    with open(fn) as f:
+        lines = f.readlines()[skip_header:skip_header + nrows]
+
+    text = ''.join(lines)
+    if '*' in text: text = overflow.sub(' nan ', text)
+
+    vals = np.fromstring(text, sep=' ')
+    if vals.size != nrows * ncols:
+        raise ValueError('Expected %d rows of %d values in %s, read %d values.' % (nrows, ncols, fn, vals.size))
+
+    return vals.reshape(nrows, ncols)
+# }}}
+
+class AsciiRun():
+# {{{
+    ''' Mixin for parameterizations wrapping a standalone executable that reads and writes ascii files. '''
+    exe      = None     # Executable, relative to the directory run() is called from
+    infile   = None     # Input file name read by the executable
+    outfiles = []       # Output file names written by the executable
+
+    keep     = 'all'    # Which ascii files to retain in ascpath: 'all', 'failed' or 'none'
+    scratch  = None     # Root of scratch directories; None uses the system default
+    block    = 64       # Number of profiles whose input decks are rendered together
+
+    def _inname(self, i):
+    # {{{
+        return self.ascpath + self.name + '_input_%d' % i
+    # }}}
+
+    def format_input(self, idx):
+    # {{{
+        ''' Render input decks for profiles idx as a list of strings. '''
+        raise NotImplementedError
+    # }}}
+
+    def write_input(self, i, fn=None, deck=None):
+    # {{{
+        ''' Write input deck of profile i to fn (by default in ascpath). '''
+        if fn is None: fn = self._inname(i)
+        if deck is None: deck = self.format_input(i)[0]
+
+        with open(fn, 'w') as f:
+            f.write(deck)
+
+        return fn
+    # }}}
+
+    def _outnames(self, i, rd):
+    # {{{
+        ''' Destination file names for the outputs of profile i, in the order of self.outfiles. '''
+        raise NotImplementedError
+    # }}}
+
+    def _store(self, i, ofns, rd):
+    # {{{
+        ''' Read output files of profile i into output object rd. '''
+        raise NotImplementedError
+    # }}}
+
+    def _retain(self, i, rd, ifn, ofns):
+    # {{{
+        # Copy whatever files a failed profile left behind to ascpath
+        for src, dst in zip([ifn] + ofns, [self._inname(i)] + self._outnames(i, rd)):
+            if os.path.exists(src): shutil.copyfile(src, dst)
+    # }}}
+
+    def _run_profile(self, i, wdir, exe, rd, keep, deck):
+    # {{{
+        inp  = os.path.join(wdir, self.infile)
+        outs = [os.path.join(wdir, o) for o in self.outfiles]
+        tm   = self._timing
+
+        try:
+            with tm.phase('write_input'):
+                if keep == 'all':
+                    # Write input to ascpath, link it into working directory
+                    os.symlink(os.path.abspath(self.write_input(i, deck=deck)), inp)
+                else:
+                    self.write_input(i, inp, deck)
+            tm.count('files_written')
+            tm.count('bytes_written', len(deck))
+
+            with tm.phase('exec'):
+                ret = subprocess.call(exe, cwd=wdir)
+            tm.count('launches')
+            if ret != 0:
+                raise RuntimeError('%s exited with status %d on profile %d.' % (self.exe, ret, i))
+
+            ofns = outs
+            if keep == 'all':
+                # Move outputs to destination
+                with tm.phase('move'):
+                    ofns = self._outnames(i, rd)
+                    for src, dst in zip(outs, ofns): os.rename(src, dst)
+
+            with tm.phase('parse'):
+                self._store(i, ofns, rd)
+        except:
+            if keep == 'failed': self._retain(i, rd, inp, outs)
+            raise
+        finally:
+            for fn in [inp] + outs:
+                if os.path.lexists(fn): os.unlink(fn)
+    # }}}
+
+    def _dispatch(self, rd, idx, workers=1, keep=None, scratch=None):
+    # {{{
+        ''' Run the executable on profiles idx, keeping up to workers processes in flight.
+            Each worker gets its own scratch directory; workers=None uses one per cpu.
+            Unless keep is 'all', input and output files only exist in the scratch
+            directories, which are removed once the run finishes or fails. A serial
+            run keeping all files works in the current directory, unless a scratch
+            root is given. Runs which would write the same files (keeping all files of
+            parameter sets of the same name, or working in the same directory) are
+            made one after the other, even when started from different threads. '''
+        exe = os.path.abspath(self.exe)
+
+        if keep is None: keep = self.keep
+        if scratch is None: scratch = self.scratch
+        if keep not in ['all', 'failed', 'none']:
+            raise ValueError("keep must be one of 'all', 'failed' or 'none'; received '%s'." % keep)
+
+        if workers is None: workers = multiprocessing.cpu_count()
+        workers = max(1, min(workers, len(idx)))
+
+        locks = []
+        if keep == 'all':
+            locks.append(_lock(self.ascpath + self.name))
+            if workers == 1 and scratch is None: locks.append(_lock(self.infile))
+
+        for l in locks: l.acquire()
+        try: self._launch(rd, idx, workers, keep, scratch, exe)
+        finally:
+            for l in reversed(locks): l.release()
+    # }}}
+
+    def _launch(self, rd, idx, workers, keep, scratch, exe):
+    # {{{
+        # Decks are rendered in blocks of profiles, which workers take in turn
+        blk = max(1, min(self.block, -(-len(idx) // workers)))
+        queue = Queue.Queue()
+        for b in range(0, len(idx), blk): queue.put(idx[b:b + blk])
+
+        errors = []
+        def work(wdir):
+            while not errors:
+                try: blk = queue.get_nowait()
+                except Queue.Empty: return
+
+                try:
+                    with self._timing.phase('render'): decks = self.format_input(blk)
+                    for i, deck in zip(blk, decks):
+                        self._run_profile(i, wdir, exe, rd, keep, deck)
+                except Exception as e: errors.append(e)
+
+        if workers == 1 and keep == 'all' and scratch is None:
+            if os.path.exists(self.infile):
+                raise ValueError('Warning: existing %s will be overwritten. Aborting.' % self.infile)
+
+            work('.')
+            if len(errors) > 0: raise errors[0]
+            return
+
+        dirs = []
+        try:
+            for w in range(workers):
+                dirs.append(tempfile.mkdtemp(prefix=self.name + '_', dir=scratch))
+
+            if workers == 1:
+                work(dirs[0])
+            else:
+                threads = [threading.Thread(target=work, args=(d,)) for d in dirs]
+                for t in threads: t.start()
+                for t in threads: t.join()
+        finally:
+            for d in dirs: shutil.rmtree(d, ignore_errors=True)
+
+        if len(errors) > 0: raise errors[0]
+    # }}}
+# }}}
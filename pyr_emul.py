@@ -0,0 +1,300 @@
+import numpy as np
+import ast, hashlib
+import params
+
+# Perturbation scale of each input, in its units or (for tracers) relative to the
+# reference profile. Tables are accurate within one scale of a reference profile.
+scales   = dict(T = 5., Tsfc = 5., H2O = 0.3, O3 = 0.3, emis = 0.02, cosz = 0.1, alb = 0.05)
+relative = ['H2O', 'O3']
+
+class Table():
+# {{{
+    ''' Linearization of an exact parameterization about a set of reference profiles.
+
+        For each reference profile the table holds the exact outputs and their
+        Jacobian with respect to the emulated inputs, found by central differences
+        of one scale, and the largest heating rate error of the linearization at
+        random points within one scale of the reference. Other inputs are not
+        emulated; columns which differ from every reference in them are out of domain. '''
+
+    def __init__(self, **fields):
+    # {{{
+        self.__dict__.update(fields)
+    # }}}
+
+    def __repr__(self):
+    # {{{
+        return '<Table: %s.%s, %d levels, %d reference profiles>' % (self.module, self.cls, self.Nl, len(self.x))
+    # }}}
+
+    @staticmethod
+    def build(exact, names=None, nval=10, seed=0, **kwargs):
+    # {{{
+        ''' Build a table from the profiles of parameter set exact (of a concrete LW or SW
+            parameterization) as references, perturbing inputs names (by default all of
+            those in scales). nval random points per reference estimate the error. Other
+            keyword arguments are passed to the runs of exact. '''
+        cls = exact.__class__
+        if names is None: names = [k for k in sorted(scales.keys()) if exact._index.has_key(k)]
+
+        profs, consts = split(exact)
+        ref = dict([(k, v.copy()) for k, v in profs.iteritems()])
+
+        rd  = exact.run(**kwargs)
+        if len(exact._outsets(rd)) != 1:
+            raise ValueError('Tables can only be built for parameterizations with a single output set.')
+        outs = sorted(rd._index.keys())
+        hr   = [k for k in outs if k.endswith('hr')][0]
+
+        R   = exact.Np
+        x   = np.concatenate([ref[k].reshape(R, -1) for k in names], axis=1)
+        s   = np.concatenate([scale(k, ref[k]).reshape(R, -1) for k in names], axis=1)
+        y0  = flatten(rd, outs)
+        n   = x.shape[1]
+        J   = np.empty((R, y0.shape[1], n))
+        err = np.empty(R)
+
+        rnd = np.random.RandomState(seed)
+        for r in range(R):
+            # Central differences of every input, then random points within the domain
+            X = np.tile(x[r], (2 * n + nval, 1))
+            X[np.arange(n), np.arange(n)] += s[r]
+            X[n + np.arange(n), np.arange(n)] -= s[r]
+            X[2 * n:] += s[r] * rnd.uniform(-1., 1., (nval, n))
+
+            prm = cls(exact.Nl, 2 * n + nval)
+            prm.update(**consts)
+            prm.update(**dict([(k, v[r:r + 1]) for k, v in ref.iteritems()]))
+            prm.update(**unflatten(X, names, ref))
+            Y = flatten(prm.run(**kwargs), outs)
+
+            J[r] = ((Y[:n] - Y[n:2 * n]) / (2 * s[r][:, None])).T
+
+            # Error of the heating rate at the random points
+            Ye = y0[r] + np.dot(X[2 * n:] - x[r], J[r].T)
+            o  = offsets(rd, outs)
+            err[r] = np.max(np.abs(Ye - Y[2 * n:])[:, o[hr][0]:o[hr][1]]) if nval > 0 else 0.
+
+        return Table(module = cls.__module__, cls = cls.__name__, Nl = exact.Nl, names = names, \
+                     outs = outs, ref = ref, consts = consts, x = x, s = s, y0 = y0, J = J, err = err)
+    # }}}
+
+    def save(self, fn):
+    # {{{
+        ''' Save table to .npz file fn. '''
+        arrays = dict([('ref_' + k, v) for k, v in self.ref.iteritems()])
+        np.savez(fn, x = self.x, s = self.s, y0 = self.y0, J = self.J, err = self.err, \
+                 info = np.array(repr(dict(module = self.module, cls = self.cls, Nl = self.Nl, \
+                        names = self.names, outs = self.outs, consts = self.consts))), **arrays)
+    # }}}
+
+    @staticmethod
+    def load(fn):
+    # {{{
+        ''' Load table saved with save(). Metadata is parsed as a literal, so a table file
+            cannot execute code. '''
+        f = np.load(fn)
+        fields = ast.literal_eval(str(f['info']))
+        fields['ref'] = dict([(k[4:], f[k]) for k in f.files if k.startswith('ref_')])
+        for k in ['x', 's', 'y0', 'J', 'err']: fields[k] = f[k]
+        return Table(**fields)
+    # }}}
+
+    def digest(self):
+    # {{{
+        ''' Hash of the contents of the table, computed once. '''
+        if not self.__dict__.has_key('_digest'):
+            h = hashlib.sha1(repr((self.module, self.cls, self.Nl, self.names, self.outs, sorted(self.consts.items()))))
+            for k in sorted(self.ref.keys()): h.update(k + np.ascontiguousarray(self.ref[k]).tostring())
+            for v in [self.x, self.s, self.y0, self.J, self.err]: h.update(np.ascontiguousarray(v).tostring())
+            self._digest = h.hexdigest()
+        return self._digest
+    # }}}
+
+    def exact(self, Np):
+    # {{{
+        ''' New parameter set of the exact parameterization, with the table's constants. '''
+        cls = getattr(__import__(self.module), self.cls)
+        prm = cls(self.Nl, Np)
+        prm.update(**self.consts)
+        return prm
+    # }}}
+# }}}
+
+def scale(name, v):
+# {{{
+    if name in relative: return scales[name] * np.abs(v)
+    return scales[name] * np.ones_like(v)
+# }}}
+
+def split(prm):
+# {{{
+    ''' Values of the parameters of prm defined per profile, and of the others. '''
+    profs, consts = {}, {}
+    for k, p in prm._index.iteritems():
+        if hasattr(p.value, 'shape') and p.value.ndim > 0 and p.value.shape[0] == prm.Np:
+            profs[k] = p.value
+        elif not hasattr(p.value, 'shape'):
+            consts[k] = p.value
+    return profs, consts
+# }}}
+
+def offsets(rd, outs):
+# {{{
+    o, d = {}, 0
+    for k in outs:
+        n = getattr(rd, k)[0].size
+        o[k] = (d, d + n)
+        d += n
+    return o
+# }}}
+
+def flatten(rd, outs):
+# {{{
+    return np.concatenate([getattr(rd, k).reshape(len(getattr(rd, k)), -1) for k in outs], axis=1)
+# }}}
+
+def unflatten(X, names, ref):
+# {{{
+    vals, d = {}, 0
+    for k in names:
+        shp = ref[k].shape[1:]
+        n   = int(np.prod(shp))
+        vals[k] = X[:, d:d + n].reshape((len(X),) + shp)
+        d += n
+    return vals
+# }}}
+
+def emulout(pset, Nprof):
+# {{{
+    ncaxp = ('profiles',)
+    return params.Namelist('emulout', \
+        [params.Param('error', np.zeros(Nprof, 'd'), units = 'K/day', ncaxes=ncaxp)],\
+        pset)
+# }}}
+
+class Emulator():
+# {{{
+    ''' Mixin for parameterizations evaluating a Table of an exact parameterization.
+
+        Columns within one perturbation scale of a reference profile of the table (and
+        equal to it in all other inputs) are emulated. Their estimated heating rate
+        error, growing quadratically from the reference to the validation error of
+        the table at one scale, is returned as output parameter error. Other columns,
+        and those whose estimated error exceeds tol, are computed by the exact
+        parameterization; their error is reported as zero. '''
+
+    def _init_table(self, kwargs):
+    # {{{
+        self.__dict__['table'] = kwargs.pop('table', None)
+        self.__dict__['tol']   = kwargs.pop('tol', None)
+    # }}}
+
+    def _cachekey(self):
+    # {{{
+        ''' Results depend on the table and tolerance as well as the inputs. '''
+        tbl = 'None' if self.table is None else self.table.digest()
+        return '%s table=%s tol=%r' % (params.RadParams._cachekey(self), tbl, self.tol)
+    # }}}
+
+    def _domain(self, idx):
+    # {{{
+        ''' Nearest reference profile of each of columns idx, and its distance in scales. '''
+        tbl = self.table
+        if tbl is None: raise ValueError('No table set; build one with pyr_emul.Table.build.')
+        if tbl.Nl != self.Nl:
+            raise ValueError('Table has %d levels; parameter set has %d.' % (tbl.Nl, self.Nl))
+
+        R = len(tbl.x)
+        X = np.concatenate([getattr(self, k)[idx].reshape(len(idx), -1) for k in tbl.names], axis=1)
+        d = np.max(np.abs(X[:, None, :] - tbl.x[None, :, :]) / tbl.s[None, :, :], axis=2)
+
+        # Inputs that are not emulated must match the reference
+        for k, v in tbl.ref.iteritems():
+            if k in tbl.names or not self._index.has_key(k): continue
+            same = np.all(np.isclose(getattr(self, k)[idx].reshape(len(idx), 1, -1), \
+                                     v.reshape(1, R, -1)), axis=2)
+            d[~same] = np.inf
+        for k, v in tbl.consts.iteritems():
+            if self._index.has_key(k) and getattr(self, k) != v: d[:] = np.inf
+
+        r = np.argmin(d, axis=1)
+        return X, r, d[np.arange(len(idx)), r]
+    # }}}
+
+    def _compute(self, rd, idx, **kwargs):
+    # {{{
+        ''' Emulate profiles idx; columns outside the table's domain are passed to the exact
+            parameterization along with keyword arguments. '''
+        tbl = self.table
+        X, r, d = self._domain(idx)
+        err = tbl.err[r] * d**2
+
+        ok = d <= 1.
+        if self.tol is not None: ok &= err <= self.tol
+
+        em = idx[ok]
+        if len(em) > 0:
+            dX = X[ok] - tbl.x[r[ok]]
+            Y  = tbl.y0[r[ok]] + np.einsum('nij,nj->ni', tbl.J[r[ok]], dX)
+            o  = offsets(rd, tbl.outs)
+            for k in tbl.outs:
+                getattr(rd, k)[em] = Y[:, o[k][0]:o[k][1]].reshape((len(em),) + getattr(rd, k).shape[1:])
+            rd.error[em] = err[ok]
+
+        fb = idx[~ok]
+        self._timing.count('fallback', len(fb))
+        if len(fb) > 0:
+            prm = tbl.exact(len(fb))
+            profs, consts = split(self)
+            prm.update(**dict([(k, v) for k, v in consts.iteritems() if prm._index.has_key(k)]))
+            prm.update(**dict([(k, v[fb]) for k, v in profs.iteritems() if prm._index.has_key(k)]))
+            ex = prm.run(**kwargs)
+            for k in tbl.outs: getattr(rd, k)[fb] = getattr(ex, k)
+            rd.error[fb] = 0.
+    # }}}
+# }}}
+
+class EMUL_LW(Emulator, params.LW):
+# {{{
+    prmname = 'EMUL'
+
+    def __init__(self, Nl, Np=1, **kwargs):
+    # {{{
+        self._init_table(kwargs)
+        params.LW.__init__(self, self.prmname, Nl, Np, **kwargs)
+    # }}}
+
+    def _alloc(self):
+    # {{{
+        return EMULOut_LW(self.prmname, self.Nl, self.Np)
+    # }}}
+# }}}
+
+class EMULOut_LW(params.LWOut):
+# {{{
+    def __init__(self, name, Nl, Np=1):
+        params.LWOut.__init__(self, name, Nl, Np, lists=[emulout(self, Np)])
+# }}}
+
+class EMUL_SW(Emulator, params.SW):
+# {{{
+    prmname = 'EMUL'
+
+    def __init__(self, Nl, Np=1, **kwargs):
+    # {{{
+        self._init_table(kwargs)
+        params.SW.__init__(self, self.prmname, Nl, Np, **kwargs)
+    # }}}
+
+    def _alloc(self):
+    # {{{
+        return EMULOut_SW(self.prmname, self.Nl, self.Np)
+    # }}}
+# }}}
+
+class EMULOut_SW(params.SWOut):
+# {{{
+    def __init__(self, name, Nl, Np=1):
+        params.SWOut.__init__(self, name, Nl, Np, lists=[emulout(self, Np)])
+# }}}
@@ -1,6 +1,134 @@
 import numpy as np
+import os, multiprocessing
+from multiprocessing import sharedctypes
 import params
-from rrtm import rrtmg
+
+# The compiled module is only needed to run; parameter sets can be built without it
+try:
+    from rrtm import rrtmg
+except ImportError:
+    rrtmg = None
+
+_cpair = None   # Value of cpair rrtmg was last initialized with
+
+def init(cpair):
+# {{{
+    ''' Initialize rrtmg, unless it has already been initialized with this cpair. '''
+    global _cpair
+    if rrtmg is None: raise ImportError('RRTMG requires the compiled rrtm.rrtmg module.')
+    if cpair != _cpair:
+        rrtmg.init(cpair)
+        _cpair = cpair
+# }}}
+
+def blocks(prm, idx, names, chunk_size=None, work=None):
+# {{{
+    ''' Iterate over blocks of at most chunk_size of the profiles idx (all at once by default),
+        yielding the profiles in each block and Fortran-ordered copies of the named parameters.
+        The copies are made into work buffers that are reused from block to block and, if
+        work is a dict, kept in it by name for later calls. '''
+    N = len(idx)
+    n = N if chunk_size is None else max(1, min(chunk_size, N))
+    vals = [getattr(prm, k) for k in names]
+
+    # Runs of consecutive profiles are indexed by slices, which copy without temporaries
+    contig = N > 0 and np.all(np.diff(idx) == 1)
+
+    # Parameters stored in Fortran order (see RadParams, ParamSet.bind) are passed
+    # without copying when all profiles go in a single block
+    if contig and n == N:
+        blk  = slice(idx[0], idx[0] + N)
+        bufs = [v[blk] for v in vals]
+        if all([b.flags.f_contiguous and b.dtype == np.float64 for b in bufs]):
+            yield blk, bufs
+            return
+
+    if work is None: work = {}
+    for b in range(0, N, n):
+        m = min(n, N - b)
+        if contig: blk = slice(idx[b], idx[b] + m)
+        else:      blk = idx[b:b + m]
+
+        # One flat buffer per parameter, grown to the largest block seen; blocks are
+        # Fortran-ordered views of its beginning
+        bufs = []
+        for k, v in zip(names, vals):
+            shape = (m,) + v.shape[1:]
+            size  = int(np.prod(shape))
+            if not work.has_key(k) or work[k].size < size: work[k] = np.empty(n * size // m, 'd')
+            bufs.append(work[k][:size].reshape(shape, order='F'))
+
+        for buf, v in zip(bufs, vals): buf[...] = v[blk]
+        yield blk, bufs
+# }}}
+
+def check(pf, ph, co2, h2o, o3):
+# {{{
+    if np.any(np.diff(pf) < 0.) or np.any(np.diff(ph) < 0.):
+        raise ValueError('Pressure values must be strictly increasing.')
+
+    for chi, name in zip([co2, h2o, o3], ['CO2', 'H2O', 'O3']):
+        if np.any(chi < 0.) or np.any(np.isnan(chi)):
+            raise ValueError('%s values must be finite and non-negative.' % name)
+# }}}
+
+def serial(prm, dest, idx, names, call, chunk_size=None):
+# {{{
+    ''' Compute profiles idx of prm in blocks of at most chunk_size, passing the named
+        parameters to call and storing the returned fields in the arrays of dict dest. '''
+    tm = prm._timing
+    for blk, bufs in blocks(prm, idx, names, chunk_size, prm._work):
+        # Parameter lists begin with pres, phalf and end with CO2, H2O, O3
+        with tm.phase('check'): check(bufs[0], bufs[1], *bufs[-3:])
+
+        with tm.phase('rrtmg'): retv = call(*bufs)
+        tm.count('calls')
+
+        for k, v in dest.iteritems():
+            if not retv.has_key(k):
+                raise KeyError('rrtmg returned no %s; received %s.' % (k, ', '.join(sorted(retv.keys()))))
+            v[blk] = retv[k]
+# }}}
+
+def compute(prm, rd, idx, names, call, chunk_size=None, workers=1):
+# {{{
+    ''' Compute profiles idx of prm into output object rd. With workers > 1 (or None, one
+        per cpu) the profiles are split between that many forked processes. These read
+        the inputs from the memory they share with the parent and write the outputs to
+        shared buffers, so that no data is pickled. '''
+    dest = dict([(k, getattr(rd, k)) for k in rd._index.keys()])
+
+    if workers is None: workers = multiprocessing.cpu_count()
+    workers = max(1, min(workers, len(idx)))
+    if workers == 1:
+        serial(prm, dest, idx, names, call, chunk_size)
+        return
+
+    if not hasattr(os, 'fork'):
+        raise ValueError('Running rrtmg with several workers requires os.fork.')
+
+    # Output buffers are allocated before forking so that all processes map them
+    shared = {}
+    for k, v in dest.iteritems():
+        buf = sharedctypes.RawArray('d', v.size)
+        shared[k] = np.frombuffer(buf, 'd').reshape(v.shape)
+
+    errors = multiprocessing.Queue()
+    def work(shard):
+        try: serial(prm, shared, shard, names, call, chunk_size)
+        except Exception as e: errors.put(e)
+
+    procs = [multiprocessing.Process(target=work, args=(s,)) for s in np.array_split(idx, workers)]
+    for p in procs: p.start()
+    for p in procs: p.join()
+
+    if not errors.empty(): raise errors.get()
+    for p in procs:
+        if p.exitcode != 0:
+            raise RuntimeError('rrtmg worker process exited with status %d.' % p.exitcode)
+
+    for k, v in dest.iteritems(): v[idx] = shared[k][idx]
+# }}}
 
 class RRTMG_LW(params.LW):
 # {{{
@@ -13,38 +141,15 @@ class RRTMG_LW(params.LW):
         params.LW.__init__(self, self.prmname, Nl, Np, lists=lists, **kwargs)
     # }}}
 
-    def run(self):
+    def _compute(self, rd, idx, chunk_size=None, workers=1):
     # {{{
-        def sanitize(a): return np.asfortranarray(a[:], 'd')
-
-        t    = sanitize(self.T)
-        pf   = sanitize(self.pres)
-        ph   = sanitize(self.phalf)
-
-        co2  = sanitize(self.CO2)
-        h2o  = sanitize(self.H2O)
-        o3   = sanitize(self.O3)
-
-        tsfc = sanitize(self.Tsfc)
-        emis = sanitize(self.emis)
-
-        if np.any(np.diff(pf)) < 0. or np.any(np.diff(ph) < 0.):
-            raise ValueError('Pressure values must be strictly increasing.')
-
-        for chi, name in zip([co2, h2o, o3], ['CO2', 'H2O', 'O3']):
-            if np.any(chi < 0.) or np.any(np.isnan(chi)):
-                raise ValueError('%s values must be finite and non-negative.' % name)
-
-        rrtmg.init(self.cpair)
+        ''' Run rrtmg_lw on profiles idx, passing at most chunk_size profiles to each call.
+            With workers > 1 (or None, one per cpu) profiles are split between processes. '''
+        names = ['pres', 'phalf', 'T', 'Tsfc', 'emis', 'CO2', 'H2O', 'O3']
 
-        retv = rrtmg.rrtmg_lw(pf, ph, t, tsfc, emis, co2, h2o, o3)
+        init(self.cpair)
 
-        rd = self._lwout()
-        rd.lwhr   = retv['lwhr']
-        rd.uflxlw = retv['uflxlw']
-        rd.dflxlw = retv['dflxlw']
-
-        return rd
+        compute(self, rd, idx, names, rrtmg.rrtmg_lw, chunk_size, workers)
     # }}}
 # }}}
 
@@ -59,40 +164,19 @@ class RRTMG_SW(params.SW):
         params.SW.__init__(self, self.prmname, Nl, Np, lists=lists, **kwargs)
     # }}}
 
-    def run(self):
+    def _compute(self, rd, idx, chunk_size=None, workers=1):
     # {{{
-        def sanitize(a): return np.asfortranarray(a[:], 'd')
-
-        pf   = sanitize(self.pres)
-        ph   = sanitize(self.phalf)
-        t    = sanitize(self.T)
-        tsfc = sanitize(self.Tsfc)
-
-        co2  = sanitize(self.CO2)
-        h2o  = sanitize(self.H2O)
-        o3   = sanitize(self.O3)
-
-        scon = self.scon
-        cosz = sanitize(self.cosz)
-        alb  = sanitize(self.alb)
-
-        if np.any(np.diff(pf)) < 0. or np.any(np.diff(ph) < 0.):
-            raise ValueError('Pressure values must be strictly increasing.')
-
-        for chi, name in zip([co2, h2o, o3], ['CO2', 'H2O', 'O3']):
-            if np.any(chi < 0.) or np.any(np.isnan(chi)):
-                raise ValueError('%s values must be finite and non-negative.' % name)
-
-        rrtmg.init(self.cpair)
+        ''' Run rrtmg_sw on profiles idx, passing at most chunk_size profiles to each call.
+            With workers > 1 (or None, one per cpu) profiles are split between processes. '''
+        names = ['pres', 'phalf', 'T', 'Tsfc', 'cosz', 'alb', 'CO2', 'H2O', 'O3']
+        scon  = self.scon
 
-        retv = rrtmg.rrtmg_sw(pf, ph, t, tsfc, scon, cosz, alb, co2, h2o, o3)
+        def call(pf, ph, t, tsfc, cosz, alb, co2, h2o, o3):
+            return rrtmg.rrtmg_sw(pf, ph, t, tsfc, scon, cosz, alb, co2, h2o, o3)
 
-        rd = self._swout()
-        rd.swhr   = retv['swhr']
-        rd.uflxsw = retv['uflxsw']
-        rd.dflxsw = retv['dflxsw']
+        init(self.cpair)
 
-        return rd
+        compute(self, rd, idx, names, call, chunk_size, workers)
     # }}}
 # }}}
 
@@ -1,12 +1,28 @@
 import numpy as np
 import params
-import subprocess, os
-
-class ZH(params.SW, params.LW):
+import pyr_ascii
+
+# Optional in-process build of the Morcrette code; see notes.rst. Without it,
+# profiles are run through the zh_lw_sw executable.
+try:
+    from zh import morcrette
+except ImportError:
+    morcrette = None
+
+# Fixed-width records of ZH input decks; fields varying by profile are left
+# as %-style conversions so that a whole deck is rendered with a single % operation.
+record0   = '{month:>10d}{day:>15.6f}%15.3f%15.3f%15.3f\n'     # lat, albedo, zenitha
+surface_T = '%10.3f\n'                                          # TBOUND
+record1   = '{LEVEL:>10d}%15.6f%15.7e%15.3f%15.7e\n'            # TLEVEL, H2O, PLEVEL, O3
+
+class ZH(params.SW, params.LW, pyr_ascii.AsciiRun):
 # {{{
     ''' Parent class for longwave column radiative transfer calculations. '''
-    prmname = 'ZH'
-    ascpath = './zh_ascii/'
+    prmname  = 'ZH'
+    ascpath  = './zh_ascii/'
+    exe      = './zh_lw_sw'
+    infile   = 'INPUT_ZH'
+    outfiles = ['OUTPUT_ZH_LW', 'OUTPUT_ZH_SW', 'FLUXES_LW', 'FLUXES_SW']
 
     # Define parameter model, serialization options
     def __init__(self, Nl, Np=1, **kwargs):
@@ -16,94 +32,106 @@ class ZH(params.SW, params.LW):
         params.LW.__init__(self, self.prmname, Nl, Np, lists=lists, **kwargs)
     # }}}
 
-    def write_input(self, i):
+    def format_input(self, idx):
     # {{{
-        fn = self.ascpath + self.name + '_input_%d' % i
-        record0      = '{month:>10d}{day:>15.6f}{lat:>15.3f}{albedo:>15.3f}{zenitha:>15.3f}\n'
-        surface_T   = '{TBOUND:>10.3f}\n'
-        record1      = '{LEVEL:>10d}{TLEVEL:>15.6f}{H2O:>15.7e}{PLEVEL:>15.3f}{O3:>15.7e}\n'
-
-        l0  = dict(month   = 1, \
-                   day     = 1, \
-                   lat     = self.lat[i], \
-                   albedo  = self.alb[i], \
-                   zenitha = self.cosz[i]*180/np.pi)
-        l1  = dict(TBOUND = self.Tsfc[i])
-        l2  = dict(LEVEL   = i,     \
-                   TLEVEL  = self.T    [i, self.Nl - 1], \
-                   H2O     = self.H2O  [i, self.Nl - 1], \
-                   PLEVEL  = self.pres [i, self.Nl - 1], \
-                   O3      = self.O3   [i, self.Nl - 1])
-
-        with open(fn, 'w') as f:
-            f.write(record0.format(**l0))
-            f.write(surface_T.format(**l1))
-
-            for k in range(self.Nl)[::-1]:
-                l2['LEVEL']   = self.Nl - k
-                l2['TLEVEL']  = self.T    [i, k]
-                # Pressure in Pa
-                l2['PLEVEL']  = self.pres [i, k]*100 
-                l2['H2O']     = self.H2O  [i, k]
-                l2['O3']      = self.O3   [i, k]
-                f.write(record1.format(**l2))
-
-        return fn
+        ''' Render input decks for profiles idx, formatting all levels of each profile at once. '''
+        idx = np.atleast_1d(idx)
+        k   = np.arange(self.Nl)[::-1]
+
+        fmt = record0.format(month = 1, day = 1) + surface_T \
+            + ''.join([record1.format(LEVEL = l) for l in range(1, self.Nl + 1)])
+
+        # Pressure in Pa
+        lev = np.stack([self.T[idx][:, k], self.H2O[idx][:, k], self.pres[idx][:, k]*100, self.O3[idx][:, k]], axis=2)
+
+        vals = np.column_stack([self.lat[idx], self.alb[idx], self.cosz[idx]*180/np.pi, \
+                                self.Tsfc[idx], lev.reshape(len(idx), -1)])
+
+        return [fmt % tuple(v) for v in vals.tolist()]
     # }}}
 
-    def read_flux_lw(self, fn):
+    def read_hr(self, fn, hr, i):
     # {{{
-        colnames = ['uflxlw', 'dflxlw', 'netflxlw','pres']
-        return np.genfromtxt(fn, names = colnames, filling_values=0.)
+        ''' Read heating rates (OUTPUT_ZH_LW or OUTPUT_ZH_SW) from fn into profile i of array hr. '''
+        hr[i, ::-1] = pyr_ascii.read_columns(fn, self.Nl, 1)[:, 0]
     # }}}
 
-    def read_flux_sw(self, fn):
+    def read_flux_lw(self, fn, rd_lw, i):
     # {{{
-        colnames = ['dflxsw','uflxsw','netflxsw','pres']
-        return np.genfromtxt(fn, names = colnames, filling_values=0.)
+        # Columns: uflxlw, dflxlw, netflxlw, pres
+        retv = pyr_ascii.read_columns(fn, self.Nl + 1, 4)
+        rd_lw.uflxlw[i, :] = retv[:, 0]
+        rd_lw.dflxlw[i, :] = retv[:, 1]
+    # }}}
+
+    def read_flux_sw(self, fn, rd_sw, i):
+    # {{{
+        # Columns: dflxsw, uflxsw, netflxsw, pres
+        retv = pyr_ascii.read_columns(fn, self.Nl + 1, 4)
+        rd_sw.uflxsw[i, :] = retv[:, 1]
+        rd_sw.dflxsw[i, :] = retv[:, 0]
+    # }}}
+
+    def _outnames(self, i, rd):
+    # {{{
+        rd_lw, rd_sw = rd['rd_lw'], rd['rd_sw']
+        return [self.ascpath + rd_lw.name + '_output_lw_%d' % i,
+                self.ascpath + rd_sw.name + '_output_sw_%d' % i,
+                self.ascpath + rd_lw.name + '_output_fluxes_%d' % i,
+                self.ascpath + rd_sw.name + '_output_fluxes_%d' % i]
+    # }}}
+
+    def _store(self, i, ofns, rd):
+    # {{{
+        ofn_lw, ofn_sw, ofn_flux_lw, ofn_flux_sw = ofns
+        rd_lw, rd_sw = rd['rd_lw'], rd['rd_sw']
+
+        # read OUTPUT_ZH into output arrays
+        self.read_hr(ofn_lw, rd_lw.lwhr, i)
+        self.read_hr(ofn_sw, rd_sw.swhr, i)
+        self.read_flux_lw(ofn_flux_lw, rd_lw, i)
+        self.read_flux_sw(ofn_flux_sw, rd_sw, i)
+    # }}}
+
+    def _alloc(self):
+    # {{{
+        return {'rd_lw':self._lwout(), 'rd_sw':self._swout()}
+    # }}}
+
+    def _outsets(self, rd):
+    # {{{
+        return [rd['rd_lw'], rd['rd_sw']]
+    # }}}
+
+    def _inproc(self, rd, idx):
+    # {{{
+        def sanitize(a): return np.asfortranarray(a[idx], 'd')
+
+        with self._timing.phase('morcrette'):
+            retv = morcrette.zh_lw_sw(sanitize(self.pres), sanitize(self.T), sanitize(self.Tsfc), \
+                                      sanitize(self.H2O), sanitize(self.O3), sanitize(self.lat), \
+                                      sanitize(self.cosz), sanitize(self.alb))
+
+        rd_lw, rd_sw = rd['rd_lw'], rd['rd_sw']
+        for out in [rd_lw, rd_sw]:
+            for k in out._lists[0].prm_dict.keys():
+                getattr(out, k)[idx] = retv[k]
     # }}}
 
-    def run(self):
+    def _compute(self, rd, idx, workers=1, keep=None, scratch=None, inproc=None):
     # {{{
-        # Allocate output arrays
-        rd_lw = self._lwout()
-        rd_sw = self._swout()
-
-        if os.path.exists('./INPUT_ZH'):
-            raise ValueError('Warning: existing INPUT_ZH will be overwritten. Aborting.')
-
-        for i in range(self.Np):
-            # Loop through profiles, write input files for each
-            ifn = self.write_input(i)
-
-            # Link input_zh to each file, 
-            os.symlink(ifn, './INPUT_ZH')
-
-            # call zh_lw_sw
-            subprocess.call("./zh_lw_sw")
-
-            # copy OUTPUT_ZH to destination, unlink INPUT_ZH
-            ofn_lw      = self.ascpath + rd_lw.name + '_output_lw_%d' % i
-            ofn_sw      = self.ascpath + rd_sw.name + '_output_sw_%d' % i
-            ofn_flux_lw = self.ascpath + rd_lw.name + '_output_fluxes_%d' % i
-            ofn_flux_sw = self.ascpath + rd_sw.name + '_output_fluxes_%d' % i
-            os.rename('./OUTPUT_ZH_LW', ofn_lw)
-            os.rename('./OUTPUT_ZH_SW', ofn_sw)
-            os.rename('./FLUXES_LW', ofn_flux_lw)
-            os.rename('./FLUXES_SW', ofn_flux_sw)
-            os.unlink('./INPUT_ZH')
-
-            # read OUTPUT_ZH into numpy array
-            rd_lw.lwhr = np.flipud(np.loadtxt(ofn_lw))
-            rd_sw.swhr = np.flipud(np.loadtxt(ofn_sw))
-            flux_lw = self.read_flux_lw(ofn_flux_lw)
-            flux_sw = self.read_flux_sw(ofn_flux_sw)
-            rd_lw.uflxlw[i, :] = flux_lw['uflxlw']
-            rd_lw.dflxlw[i, :] = flux_lw['dflxlw']
-            rd_sw.uflxsw[i, :] = flux_sw['uflxsw']
-            rd_sw.dflxsw[i, :] = flux_sw['dflxsw']
-
-        return {'rd_lw':rd_lw, 'rd_sw':rd_sw}
+        ''' Run zh_lw_sw on profiles idx. With workers > 1 (or None, one per cpu) profiles
+            are run concurrently, each worker in its own scratch directory. keep sets which
+            ascii files are retained in ascpath ('all', 'failed' or 'none'); scratch is the
+            root for scratch directories, e.g. '/dev/shm'. If inproc (by default, whenever
+            the compiled zh.morcrette module is available) profiles are computed in-process. '''
+        if inproc is None: inproc = morcrette is not None
+
+        if inproc:
+            if morcrette is None: raise ImportError('In-process ZH requires the compiled zh.morcrette module.')
+            self._inproc(rd, idx)
+        else:
+            self._dispatch(rd, idx, workers, keep, scratch)
     # }}}
 # }}}
 
@@ -113,7 +141,7 @@ def zhprofile(pset, Nl, Nprof):
     one  = np.ones((Nprof, Nl), 'd')
     onep  = np.ones(Nprof, 'd')
     ncax  = ('profiles', 'levels')
-    ncaxp  = ('profiles')
+    ncaxp  = ('profiles',)
     return params.Namelist('profile', \
         [params.Param('lat',  10. * onep, ncaxes=ncaxp),\
         params.Param('T',  250. * one, ncaxes=ncax)],\
@@ -123,24 +151,25 @@ def zhprofile(pset, Nl, Nprof):
 def zhswbase(pset, Nprof):
 # {{{
     onep  = np.ones(Nprof, 'd')
-    ncaxp  = ('profiles')
+    ncaxp  = ('profiles',)
     return params.Namelist('swbase', \
         [params.Param('cosz',  0.5 * onep, ncaxes=ncaxp),\
         params.Param('alb',   0.5 * onep, ncaxes=ncaxp)],\
         pset)
 # }}}
 
-Nl = 100
-zh = np.linspace(60, 0, Nl+1)
-ph = 1000.*np.exp(-zh / 7.)
-pf = np.sqrt(ph[:-1] * ph[1:]) 
-
-prm = ZH(Nl, 1, pres=pf, phalf=ph)
-prm.Tsfc = np.linspace(250, 300., 1)
-prm.lat = np.linspace(10, 30., 1)
-prm.alb = np.linspace(0.1, 1., 1)
-prm.cosz = np.linspace(0.2, 0.7, 1)
-rd = prm.run()
+if __name__ == '__main__':
+    Nl = 100
+    zh = np.linspace(60, 0, Nl+1)
+    ph = 1000.*np.exp(-zh / 7.)
+    pf = np.sqrt(ph[:-1] * ph[1:]) 
+
+    prm = ZH(Nl, 1, pres=pf, phalf=ph)
+    prm.Tsfc = np.linspace(250, 300., 1)
+    prm.lat = np.linspace(10, 30., 1)
+    prm.alb = np.linspace(0.1, 1., 1)
+    prm.cosz = np.linspace(0.2, 0.7, 1)
+    rd = prm.run()
 
 # Example usage
 #   import pyraccoons as pyr
@@ -1,14 +1,38 @@
 from params import Param, Namelist, ParamSet
 import numpy as np
+import threading, tempfile
+
+# Backends by name, as 'module:class'; modules are only imported when a backend is first
+# used, so that importing pyracc neither requires compiled codes nor starts executables
+lwprms = dict(RRTMG = 'pyr_rrtmg:RRTMG_LW',
+              RRTM  = 'pyr_rrtm:RRTM_LW',
+              EMUL  = 'pyr_emul:EMUL_LW')
+swprms = dict(RRTMG = 'pyr_rrtmg:RRTMG_SW',
+              RRTM  = 'pyr_rrtm:RRTM_SW',
+              EMUL  = 'pyr_emul:EMUL_SW')
+
+def backend(prms, prmname):
+# {{{
+    ''' Class of parameterization prmname in registry prms (lwprms or swprms), importing
+        its module if need be. '''
+    if not prms.has_key(prmname):
+        raise KeyError("Unknown parameterization '%s'; available: %s." % (prmname, ', '.join(sorted(prms.keys()))))
+    cls = prms[prmname]
+    if isinstance(cls, str):
+        mod, name = cls.split(':')
+        cls = getattr(__import__(mod), name)
+        prms[prmname] = cls
+    return cls
+# }}}
 
 def lw(prmname, Nl, Np = 1, **kwargs):
 # {{{
-    return lwprms[prmname](Nl, Np, **kwargs)
+    return backend(lwprms, prmname)(Nl, Np, **kwargs)
 # }}}
 
 def sw(prmname, Nl, Np = 1, **kwargs):
 # {{{
-    return swprms[prmname](Nl, Np, **kwargs)
+    return backend(swprms, prmname)(Nl, Np, **kwargs)
 # }}}
 
 def listcodes():
@@ -22,22 +46,285 @@ def listcodes():
         print k
 # }}}
 
-import pyr_rrtmg
-import pyr_rrtm
+class Suite():
+# {{{
+    ''' Longwave and shortwave calculations of one parameterization on a single set of profiles.
+
+        Parameters common to both (profiles, tracers, and fields derived from them) are
+        stored once and shared, derived fields are computed once, and the longwave and
+        shortwave calculations run concurrently. Parameters are set and read as
+        attributes of the suite; the individual parameter sets are suite.lw and suite.sw. '''
+
+    def __init__(self, prmname, Nl, Np = 1, order = 'C', columnar = False, **kwargs):
+    # {{{
+        self.__dict__['lw'] = lw(prmname, Nl, Np, order=order, columnar=columnar)
+        self.__dict__['sw'] = sw(prmname, Nl, Np, order=order, columnar=columnar)
+
+        # Bind shortwave parameters to the arrays of longwave parameters of the same name
+        shared, unshared = {}, []
+        for l in self.lw._lists:
+            if not l.active: continue
+            for k, p in l.prm_dict.iteritems():
+                if shared.has_key(k) or not hasattr(p.value, 'shape'): continue
+                try: swp = self.sw._param(k)
+                except AttributeError: continue
+                # Views into columnar storage cannot be bound; they are set in both sets instead
+                v = getattr(self.lw, k)
+                if not hasattr(swp.value, 'shape') or swp.value.shape != v.shape: continue
+                if v.flags.c_contiguous or v.flags.f_contiguous: shared[k] = v
+                else: unshared.append(k)
+        self.sw.bind(**shared)
+        self.__dict__['shared']   = sorted(shared.keys())
+        self.__dict__['unshared'] = sorted(unshared)
+
+        for k, v in kwargs.iteritems():
+            self.__setattr__(k, v)
+    # }}}
+
+    def __getattr__(self, name):
+    # {{{
+        try: return getattr(self.__dict__['lw'], name)
+        except AttributeError: return getattr(self.__dict__['sw'], name)
+    # }}}
+
+    def __setattr__(self, name, value):
+    # {{{
+        self._validate({name: value})
+        pver = self.lw._pver.copy()
+        for prm in [self.lw, self.sw]:
+            if not prm._index.has_key(name): continue
+            # Shared arrays only need setting once; the profiles changed are marked in both
+            if prm is self.sw and name in self.shared:
+                self.sw._pver[:] += self.lw._pver - pver
+                continue
+            prm.__setattr__(name, value)
+    # }}}
+
+    def _validate(self, kwargs, idx=None):
+    # {{{
+        # Check every value against each set holding the parameter, so that nothing is
+        # assigned unless all of it can be
+        for k, v in kwargs.iteritems():
+            prms = [prm._index[k] for prm in [self.lw, self.sw] if prm._index.has_key(k)]
+            if len(prms) == 0:
+                raise AttributeError("'%s' object has no parameter '%s'" % (self.__class__.__name__, k))
+            for p in prms: p._check(v, idx)
+    # }}}
+
+    def _apply(self, method, args, kwargs):
+    # {{{
+        # Shared arrays are set through lw, and the profiles they change marked in sw too
+        self._validate(kwargs, *args)
+        shared = dict([(k, v) for k, v in kwargs.iteritems() if k in self.shared])
+        lwonly = dict([(k, v) for k, v in kwargs.iteritems() if k not in shared and self.lw._index.has_key(k)])
+        swonly = dict([(k, v) for k, v in kwargs.iteritems() if k not in shared and self.sw._index.has_key(k)])
+
+        pver = self.lw._pver.copy()
+        if shared: getattr(self.lw, method)(*args, **shared)
+        self.sw._pver[:] += self.lw._pver - pver
+        if lwonly: getattr(self.lw, method)(*args, **lwonly)
+        if swonly: getattr(self.sw, method)(*args, **swonly)
+    # }}}
+
+    def update(self, **kwargs):
+    # {{{
+        ''' Set several parameters of both parameter sets at once; see ParamSet.update.
+            All values are validated against both sets before any is assigned. '''
+        self._apply('update', (), kwargs)
+    # }}}
+
+    def update_profiles(self, idx, **kwargs):
+    # {{{
+        ''' Set profiles idx of several parameters of both parameter sets at once; see
+            ParamSet.update_profiles. All values are validated against both sets before
+            any is assigned. '''
+        self._apply('update_profiles', (idx,), kwargs)
+    # }}}
+
+    def touch(self, idx=None):
+    # {{{
+        ''' Mark profiles idx (by default all) of both parameter sets as changed. '''
+        self.lw.touch(idx)
+        self.sw.touch(idx)
+    # }}}
+
+    def prepare(self):
+    # {{{
+        ''' Compute fields derived from the inputs. Where all fields common to both
+            parameter sets are shared they are only computed once; otherwise (e.g. with
+            columnar storage, whose views cannot be bound) both sets compute their own. '''
+        self.lw._prepare()
+        if self.unshared: self.sw._prepare()
+    # }}}
+
+    def run(self, out=None, **kwargs):
+    # {{{
+        ''' Run longwave and shortwave calculations concurrently; returns (LWOut, SWOut).
+            Results are written into out, a pair of output objects, if given. Other
+            keyword arguments are passed to both runs. '''
+        self.prepare()
+
+        opts = dict(kwargs, prepare=False)
+        # Executables of both runs need separate working directories
+        import pyr_ascii
+        if isinstance(self.lw, pyr_ascii.AsciiRun) and opts.get('scratch') is None:
+            opts['scratch'] = tempfile.gettempdir()
+
+        if out is None: out = (None, None)
+        outs = dict(lw=out[0], sw=out[1])
+
+        retv = {}
+        def work(k, prm):
+            try: retv[k] = prm.run(out=outs[k], **opts)
+            except Exception as e: retv[k] = e
+
+        threads = [threading.Thread(target=work, args=(k, p)) for k, p in [('lw', self.lw), ('sw', self.sw)]]
+        for t in threads: t.start()
+        for t in threads: t.join()
+
+        for k in ['lw', 'sw']:
+            if isinstance(retv[k], Exception): raise retv[k]
+
+        return retv['lw'], retv['sw']
+    # }}}
+# }}}
+
+class Stepper():
+# {{{
+    ''' Driver for repeated radiation calls on a fixed set of profiles, as made by a
+        time-stepping model.
+
+        Inputs are held by a Suite and overwritten in place at each step, results are
+        written into the same pair of output objects on every step, and the work
+        buffers into which the compiled codes' inputs are copied (see
+        pyr_rrtmg.blocks) are kept by the stepper, so that no parameter sets or
+        buffers are allocated once the first step is made. Arrays returned by the
+        compiled codes themselves are still new on every call. With order='F' inputs
+        are stored in Fortran order and passed to the compiled codes without copying
+        when run in a single block. options are keyword arguments passed to every run
+        (e.g. chunk_size, workers, incremental); other keyword arguments are passed
+        to Suite. '''
+
+    def __init__(self, prmname, Nl, Np = 1, options = None, **kwargs):
+    # {{{
+        self.suite   = Suite(prmname, Nl, Np, **kwargs)
+        self.out     = (self.suite.lw._alloc(), self.suite.sw._alloc())
+        self.options = {} if options is None else dict(options)
+        self.nsteps  = 0
+
+        # Work buffers, by parameter, of the longwave and shortwave runs
+        self.work    = ({}, {})
+        self.suite.lw.__dict__['_work'] = self.work[0]
+        self.suite.sw.__dict__['_work'] = self.work[1]
+    # }}}
+
+    def step(self, **kwargs):
+    # {{{
+        ''' Set parameters given as keyword arguments (e.g. T, Tsfc, H2O, cosz) and run.
+            Returns the (LWOut, SWOut) held by the stepper, which the next step overwrites. '''
+        for k, v in kwargs.iteritems():
+            setattr(self.suite, k, v)
+
+        self.suite.run(out=self.out, **self.options)
+        self.nsteps += 1
+        return self.out
+    # }}}
+# }}}
+
+class Scheduler(Stepper):
+# {{{
+    ''' Stepper making the full radiation calculation only every every steps, or when
+        requested or triggered, and reusing its results in between.
+
+        Between full calculations longwave outputs are left as they were, while
+        shortwave fluxes and heating rates are those of the last full calculation
+        rescaled by the cosine of the zenith angle relative to its value then
+        (and zero where the sun has set). A full calculation is made before it is
+        due if request() was called, if step() is passed force=True, if T or Tsfc
+        of any profile has changed by more than dT (K) since the last one, if the
+        sun has risen in any profile, or if any of triggers, functions called with
+        the scheduler, returns True. The reason for the last step's full
+        calculation, or None, is kept as reason; ncalls counts full calculations. '''
+
+    def __init__(self, prmname, Nl, Np = 1, every = 1, dT = None, triggers = None, options = None, **kwargs):
+    # {{{
+        Stepper.__init__(self, prmname, Nl, Np, options, **kwargs)
+        self.every    = every
+        self.dT       = dT
+        self.triggers = [] if triggers is None else list(triggers)
+        self.since    = None    # Steps since the last full calculation
+        self.pending  = False
+        self.reason   = None
+        self.ncalls   = 0
+
+        # Inputs and shortwave outputs of the last full calculation
+        self.last  = dict(T = np.empty((Np, Nl)), Tsfc = np.empty(Np), cosz = np.empty(Np))
+        self.swout = self.suite.sw._alloc()
+    # }}}
 
-lwprms = dict(RRTMG = pyr_rrtmg.RRTMG_LW,
-              RRTM  = pyr_rrtm.RRTM_LW)
-swprms = dict(RRTMG = pyr_rrtmg.RRTMG_SW,
-              RRTM  = pyr_rrtm.RRTM_SW)
+    def request(self):
+    # {{{
+        ''' Make a full calculation at the next step. '''
+        self.pending = True
+    # }}}
+
+    def due(self):
+    # {{{
+        ''' Reason for a full calculation at a step with the current inputs, or None. '''
+        s, last = self.suite, self.last
+        if self.since is None: return 'first'
+        if self.pending: return 'requested'
+        if self.since >= self.every: return 'scheduled'
+        if self.dT is not None and (np.max(np.abs(s.T - last['T'])) > self.dT or \
+                                    np.max(np.abs(s.Tsfc - last['Tsfc'])) > self.dT):
+            return 'temperature'
+        if np.any((s.cosz > 0.) & (last['cosz'] <= 0.)): return 'sunrise'
+        for f in self.triggers:
+            if f(self): return 'trigger'
+        return None
+    # }}}
+
+    def step(self, force = False, **kwargs):
+    # {{{
+        ''' Set parameters given as keyword arguments and make a full calculation if one
+            is due (or force is True), otherwise update the shortwave outputs for the
+            current zenith angle. Returns the (LWOut, SWOut) held by the stepper. '''
+        for k, v in kwargs.iteritems():
+            setattr(self.suite, k, v)
+        if force: self.pending = True
+
+        sw, last = self.suite.sw, self.last
+        self.reason = self.due()
+        if self.reason is not None:
+            self.suite.run(out=self.out, **self.options)
+            for k in last.keys(): last[k][...] = getattr(self.suite, k)
+            for o, l in zip(sw._outsets(self.out[1]), sw._outsets(self.swout)):
+                for k in o._index.keys(): getattr(l, k)[...] = getattr(o, k)
+            self.since   = 0
+            self.pending = False
+            self.ncalls += 1
+        else:
+            f = np.where(last['cosz'] > 0., np.maximum(sw.cosz, 0.) / np.where(last['cosz'] > 0., last['cosz'], 1.), 0.)
+            for o, l in zip(sw._outsets(self.out[1]), sw._outsets(self.swout)):
+                for k in o._index.keys():
+                    v = getattr(l, k)
+                    np.multiply(v, f.reshape((-1,) + (1,) * (v.ndim - 1)), out=getattr(o, k))
+
+        self.since  += 1
+        self.nsteps += 1
+        return self.out
+    # }}}
+# }}}
 
-Nl = 80
-zh = np.linspace(60, 0, Nl+1)
-ph = 1000.*np.exp(-zh / 7.)
-pf = np.sqrt(ph[:-1] * ph[1:]) 
+if __name__ == '__main__':
+    Nl = 80
+    zh = np.linspace(60, 0, Nl+1)
+    ph = 1000.*np.exp(-zh / 7.)
+    pf = np.sqrt(ph[:-1] * ph[1:]) 
 
-prm1 = lw('RRTMG', Nl, 1, pres=pf, phalf=ph)
-prm2 = sw('RRTMG', Nl, 1, pres=pf, phalf=ph)
-prm3 = lw('RRTM', Nl, 1, pres=pf, phalf=ph)
+    prm1 = lw('RRTMG', Nl, 1, pres=pf, phalf=ph)
+    prm2 = sw('RRTMG', Nl, 1, pres=pf, phalf=ph)
+    prm3 = lw('RRTM', Nl, 1, pres=pf, phalf=ph)
 # Example usage
 #   import pyraccoons as pyr
 
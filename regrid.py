@@ -0,0 +1,60 @@
+import numpy as np
+
+def halflevels(Nl, ratio):
+# {{{
+    ''' Indices of the native half levels bounding the layers of a grid coarser by
+        ratio; the last coarse layer holds the remaining Nl % ratio layers, if any. '''
+    if not 1 <= ratio <= Nl:
+        raise ValueError('ratio must be between 1 and Nl = %d; received %d.' % (Nl, ratio))
+    hi = list(range(0, Nl + 1, ratio))
+    if hi[-1] != Nl: hi.append(Nl)
+    return np.array(hi)
+# }}}
+
+def layers(v, ph, hi):
+# {{{
+    ''' Average of layer values v (Np, Nl) over the coarse layers bounded by half levels
+        hi, weighted by the pressure thickness of the native layers given by half level
+        pressures ph (Np, Nl + 1), so that column integrals are conserved. '''
+    dp  = np.abs(np.diff(ph, axis=1))
+    cum = np.concatenate([np.zeros((len(v), 1)), np.cumsum(v * dp, axis=1)], axis=1)
+    pc  = np.concatenate([np.zeros((len(v), 1)), np.cumsum(dp, axis=1)], axis=1)
+    return np.diff(cum[:, hi], axis=1) / np.diff(pc[:, hi], axis=1)
+# }}}
+
+def expand(vc, hi):
+# {{{
+    ''' Layer values vc (Np, Nc) on the coarse grid of half levels hi, piecewise
+        constant onto the native layers. '''
+    return np.repeat(vc, np.diff(hi), axis=1)
+# }}}
+
+def interp(fc, ph, hi):
+# {{{
+    ''' Half level values fc (Np, Nc + 1) on the coarse grid of half levels hi,
+        interpolated linearly in pressure onto the native half levels with pressures
+        ph (Np, Nl + 1). Values at half levels common to both grids are unchanged. '''
+    Nl = ph.shape[1] - 1
+    k  = np.minimum(np.searchsorted(hi, np.arange(Nl + 1), side='right') - 1, len(hi) - 2)
+    p0, p1 = ph[:, hi[k]], ph[:, hi[k + 1]]
+    w  = (ph - p0) / (p1 - p0)
+    return (1. - w) * fc[:, k] + w * fc[:, k + 1]
+# }}}
+
+def errors(coarse, full):
+# {{{
+    ''' Maximum and root mean square difference of arrays coarse and full, overall and
+        at each level. '''
+    d = coarse - full
+    return dict(max = np.max(np.abs(d)), rms = np.sqrt(np.mean(d**2)), \
+                maxlev = np.max(np.abs(d), axis=0), rmslev = np.sqrt(np.mean(d**2, axis=0)))
+# }}}
+
+def report(diagnostics):
+# {{{
+    ''' Table of the differences in diagnostics, as attached by RadParams.run_coarse, as a string. '''
+    s = '%-14s %12s %12s\n' % ('field', 'max', 'rms')
+    for k in sorted(diagnostics):
+        s += '%-14s %12.4g %12.4g\n' % (k, diagnostics[k]['max'], diagnostics[k]['rms'])
+    return s[:-1]
+# }}}
@@ -0,0 +1,152 @@
+import numpy as np
+import unittest, os, shutil, tempfile
+import pyracc, pyr_rrtmg, pyr_rrtm, pyr_zh, pyr_ascii
+
+# Run as 'python -m unittest test_pyracc' from the top level directory; requires rrtm.rrtmg.
+
+def sounding(Nl, Np):
+# {{{
+    zh = np.linspace(60, 0, Nl+1)
+    ph = 1000.*np.exp(-zh / 7.)
+    pf = np.sqrt(ph[:-1] * ph[1:])
+    return dict(pres = np.tile(pf, (Np, 1)), phalf = np.tile(ph, (Np, 1)))
+# }}}
+
+class TestSuite(unittest.TestCase):
+# {{{
+    def setUp(self):
+        if pyr_rrtmg.rrtmg is None: self.skipTest('rrtm.rrtmg is not available')
+        self.Nl, self.Np = 10, 4
+
+    def check(self, change):
+        ''' Step with incremental runs, change the inputs through the suite with change(),
+            and compare the next step against a fresh run. '''
+        st = pyracc.Stepper('RRTMG', self.Nl, self.Np, options = dict(incremental = True), **sounding(self.Nl, self.Np))
+        st.step()
+        change(st.suite)
+        lw, sw = st.step()
+
+        ref = pyracc.Suite('RRTMG', self.Nl, self.Np, **sounding(self.Nl, self.Np))
+        change(ref)
+        rlw, rsw = ref.run()
+        self.assertTrue(np.allclose(lw.lwhr, rlw.lwhr))
+        self.assertTrue(np.allclose(sw.swhr, rsw.swhr))
+        self.assertTrue(np.allclose(sw.dflxsw, rsw.dflxsw))
+
+    def test_update(self):
+        self.check(lambda s: s.update(T = s.T + 5., cosz = 0.3 * np.ones(self.Np)))
+
+    def test_update_profiles(self):
+        self.check(lambda s: s.update_profiles([1, 2], T = s.T[1:3] + 5.))
+
+    def test_touch(self):
+        def change(s):
+            s.T[2] += 5.
+            s.touch([2])
+        self.check(change)
+# }}}
+
+class TestRejected(unittest.TestCase):
+# {{{
+    def test_update(self):
+        ''' A value rejected by one parameter set leaves both unchanged. '''
+        Nl, Np = 10, 3
+        s = pyracc.Suite('RRTM', Nl, Np, **sounding(Nl, Np))
+        T, cosz, pver = s.T.copy(), s.sw.cosz.copy(), s.sw._pver.copy()
+
+        self.assertRaises(ValueError, s.update, T = T + 5., cosz = np.ones(Np + 1))
+        self.assertRaises(ValueError, s.update_profiles, [0, 1], T = T[:2] + 5., cosz = np.ones(3))
+        self.assertRaises(AttributeError, s.update, T = T + 5., nosuch = 1.)
+        self.assertTrue(np.all(s.lw.T == T) and np.all(s.sw.T == T))
+        self.assertTrue(np.all(s.sw.cosz == cosz))
+        self.assertTrue(np.all(s.sw._pver == pver))
+# }}}
+
+class TestColumnar(unittest.TestCase):
+# {{{
+    def test_prepare(self):
+        ''' Derived fields of both sets are computed when columnar views cannot be shared. '''
+        Nl, Np = 10, 3
+        h2o = np.linspace(1e-5, 1e-2, Nl)
+        s = pyracc.Suite('RRTM', Nl, Np, columnar = True, H2O = h2o, **sounding(Nl, Np))
+        s.prepare()
+
+        ref = pyracc.sw('RRTM', Nl, Np, H2O = h2o, **sounding(Nl, Np))
+        ref._prepare()
+        self.assertTrue(np.allclose(s.sw.Broad, ref.Broad))
+        self.assertTrue(np.allclose(s.lw.Broad, ref.Broad))
+# }}}
+
+class TestFormat(unittest.TestCase):
+# {{{
+    ''' Input decks match those of the fixtures in ascpath, written by the examples of
+        pyr_rrtm and pyr_zh. '''
+    def check(self, prm):
+        for i, deck in enumerate(prm.format_input(np.arange(prm.Np))):
+            with open(prm._inname(i)) as f: self.assertEqual(deck, f.read())
+
+    def test_rrtm_sw(self):
+        prm = pyr_rrtm.RRTM_SW(80, 11, **sounding(80, 11))
+        prm._prepare()
+        self.check(prm)
+
+    def test_zh(self):
+        prm = pyr_zh.ZH(100, 1, Tsfc = 250., lat = 10., alb = 0.1, cosz = 0.2, **sounding(100, 1))
+        self.check(prm)
+# }}}
+
+class TestReadColumns(unittest.TestCase):
+# {{{
+    ''' Output fixtures read with pyr_ascii.read_columns match np.genfromtxt. '''
+    def check(self, fn, nrows, ncols, skip_header=0):
+        vals = pyr_ascii.read_columns(fn, nrows, ncols, skip_header=skip_header)
+        ref  = np.genfromtxt(fn, skip_header=skip_header, max_rows=nrows).reshape(nrows, ncols)
+        self.assertTrue(np.array_equal(np.isnan(vals), np.isnan(ref)))
+        self.assertTrue(np.all((vals == ref) | np.isnan(ref)))
+        return vals
+
+    def test_rrtm_sw(self):
+        for i in range(11):
+            vals = self.check('rrtm_ascii/RRTM_SW_80levs_11profs_output_%d' % i, 81, 8, skip_header=5)
+            # Heating rate of the top layer overflows its field
+            self.assertTrue(np.isnan(vals[1, 7]))
+
+    def test_zh(self):
+        for f in ['LWout_100levs_1profs_output_fluxes_0', 'SWout_100levs_1profs_output_fluxes_0']:
+            self.check('zh_ascii/ZH_' + f, 101, 4)
+        for f in ['LWout_100levs_1profs_output_lw_0', 'SWout_100levs_1profs_output_sw_0']:
+            self.check('zh_ascii/ZH_' + f, 100, 1)
+# }}}
+
+class TestSubmit(unittest.TestCase):
+# {{{
+    def setUp(self):
+        if not os.path.exists(pyr_zh.ZH.exe): self.skipTest('%s is not available' % pyr_zh.ZH.exe)
+
+        # Runs keeping all files write to ascpath, relative to the working directory
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.mkdtemp()
+        os.symlink(os.path.abspath(pyr_zh.ZH.exe), os.path.join(self.tmp, pyr_zh.ZH.exe))
+        os.mkdir(os.path.join(self.tmp, pyr_zh.ZH.ascpath))
+        os.chdir(self.tmp)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp)
+
+    def test_concurrent(self):
+        ''' Runs submitted together with default options do not share files. '''
+        Nl, Np = 100, 2
+        prms = [pyr_zh.ZH(Nl, Np, T = T, **sounding(Nl, Np)) for T in [230., 270.]]
+        futures = [p.submit() for p in prms]
+        outs = [f.result() for f in futures]
+
+        for p, rd in zip(prms, outs):
+            ref = p.run()
+            self.assertTrue(np.allclose(rd['rd_lw'].lwhr, ref['rd_lw'].lwhr))
+            self.assertTrue(np.allclose(rd['rd_sw'].swhr, ref['rd_sw'].swhr))
+        self.assertFalse(np.allclose(outs[0]['rd_lw'].lwhr, outs[1]['rd_lw'].lwhr))
+# }}}
+
+if __name__ == '__main__':
+    unittest.main()